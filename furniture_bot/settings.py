@@ -141,6 +141,77 @@ LAUNCH_DATE = timezone.make_aware(
 
 ADMIN_CHAT_ID = config("ADMIN_CHAT_ID", default=0, cast=int)
 
+# Seconds before in-process caches (translations, catalog) are reloaded from the database
+CACHE_TTL = config("CACHE_TTL", default=60, cast=int)
+
+# Number of compiled message templates kept by rendering.render()
+TEMPLATE_CACHE_SIZE = config("TEMPLATE_CACHE_SIZE", default=512, cast=int)
+
+# Number of models per page of a category list, Telegram allows up to 100 buttons per keyboard
+MODELS_PAGE_SIZE = config("MODELS_PAGE_SIZE", default=40, cast=int)
+
+# Number of items whose rendered cards are kept in memory, per language
+ITEM_CARD_CACHE_SIZE = config("ITEM_CARD_CACHE_SIZE", default=5000, cast=int)
+
+# Seconds before the search index and inline results are rebuilt to pick up changes made by other processes
+SEARCH_INDEX_TTL = config("SEARCH_INDEX_TTL", default=600, cast=int)
+
+# Search results per page
+SEARCH_PAGE_SIZE = config("SEARCH_PAGE_SIZE", default=10, cast=int)
+
+# Inline query results per answer, Telegram allows up to 50
+INLINE_PAGE_SIZE = config("INLINE_PAGE_SIZE", default=20, cast=int)
+
+# Seconds Telegram may cache the answer to an inline query
+INLINE_CACHE_TIME = config("INLINE_CACHE_TIME", default=300, cast=int)
+
+# Bearer token Prometheus sends to /metrics, without one only staff users can read it
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# Seconds the /stats report is cached for, 0 disables the cache
+STATS_CACHE_TTL = config("STATS_CACHE_TTL", default=30, cast=int)
+
+# Worker processes producing cover renditions
+IMAGE_WORKERS = config("IMAGE_WORKERS", default=2, cast=int)
+
+# Number of Telegram users kept in memory between updates
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", default=10000, cast=int)
+
+# Seconds a cached Telegram user is trusted, edits made by other processes show up after that
+USER_CACHE_TTL = config("USER_CACHE_TTL", default=15, cast=int)
+
+# Seconds between batched writes of TelegramUser.last_seen
+LAST_SEEN_FLUSH_INTERVAL = config("LAST_SEEN_FLUSH_INTERVAL", default=30, cast=int)
+
+# Messages per second sent by broadcasts, Telegram allows about 30 for the whole bot
+BROADCAST_RATE = config("BROADCAST_RATE", default=20, cast=int)
+
+# Recipients handled between two checks of the broadcast status
+BROADCAST_BATCH = config("BROADCAST_BATCH", default=100, cast=int)
+
+# Seconds between checks for new broadcasts
+BROADCAST_POLL_INTERVAL = config("BROADCAST_POLL_INTERVAL", default=10, cast=int)
+
+# Seconds after which a recipient claimed by a worker that stopped is sent to again
+BROADCAST_CLAIM_TIMEOUT = config("BROADCAST_CLAIM_TIMEOUT", default=600, cast=int)
+
+# Seconds after which another worker process takes over broadcasts of one that stopped
+BROADCAST_LEASE_TIMEOUT = config("BROADCAST_LEASE_TIMEOUT", default=60, cast=int)
+
+# Threads processing telegram updates, each of them may hold a database connection
+BOT_WORKERS = config("BOT_WORKERS", default=8, cast=int)
+
+# Updates waiting for a worker before the bot stops fetching new ones
+BOT_QUEUE_SIZE = config("BOT_QUEUE_SIZE", default=256, cast=int)
+
+# Days after which unfinished conversations are removed by prune_conversations
+CONVERSATION_TTL_DAYS = config("CONVERSATION_TTL_DAYS", default=7, cast=int)
+
+# Webhook update ids remembered in memory and seconds they are kept in the database
+UPDATE_DEDUP_SIZE = config("UPDATE_DEDUP_SIZE", default=10000, cast=int)
+
+UPDATE_DEDUP_TTL = config("UPDATE_DEDUP_TTL", default=24 * 60 * 60, cast=int)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
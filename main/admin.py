@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.db.models import Count
 
 # Register your models here.
 from main.models import Category, Item, Message, TelegramUser, Cover, Entry, InfoButton, Map, MessageValue, \
-    MessageLanguage, InfoButtonDescription, InfoButtonName, CategoryName, MessageDescription
+    MessageLanguage, InfoButtonDescription, InfoButtonName, CategoryName, MessageDescription, Broadcast, \
+    BroadcastRecipient
 
 
 class InfoCoverInline(admin.TabularInline):
@@ -30,6 +32,7 @@ class ItemCoverInline(admin.TabularInline):
 
 class EntryInline(admin.StackedInline):
     model = Entry
+    autocomplete_fields = ('language',)
     verbose_name = 'Описание'
     verbose_name_plural = 'Описания'
     extra = 0
@@ -37,6 +40,7 @@ class EntryInline(admin.StackedInline):
 
 class InfoButtonNameInline(admin.StackedInline):
     model = InfoButtonName
+    autocomplete_fields = ('language',)
     verbose_name = 'Заголовок'
     verbose_name_plural = 'Заголовки'
     extra = 0
@@ -44,6 +48,7 @@ class InfoButtonNameInline(admin.StackedInline):
 
 class InfoButtonDescriptionInline(admin.StackedInline):
     model = InfoButtonDescription
+    autocomplete_fields = ('language',)
     verbose_name = 'Перевод'
     verbose_name_plural = 'Переводы'
     extra = 0
@@ -51,36 +56,67 @@ class InfoButtonDescriptionInline(admin.StackedInline):
 
 class CategoryNameInline(admin.StackedInline):
     model = CategoryName
+    autocomplete_fields = ('language',)
     verbose_name = 'Заголовок'
     verbose_name_plural = 'Заголовки'
     extra = 0
 
 
+class CategoryListFilter(admin.RelatedFieldListFilter):
+    def field_choices(self, field, request, model_admin):
+        # Category names come from CategoryName rows, fetch them for all categories at once
+        return [(category.pk, str(category)) for category in Category.objects.prefetch_related('names')]
+
+
 @admin.register(InfoButton)
 class InfoButtonAdmin(admin.ModelAdmin):
     list_display = ('__str__',)
-    search_fields = ('__str__',)
+    search_fields = ('names__name',)
     inlines = (InfoButtonNameInline, InfoButtonDescriptionInline, InfoCoverInline, MapInline)
     list_per_page = 25
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('names')
+
 
 @admin.register(Item)
 class ItemAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'category', 'delivery')
-    search_fields = ('item__description',)
-    list_filter = ('category',)
+    # PostgreSQL serves the description lookup from the trigram index of migration 0055
+    search_fields = ('=number', 'entries__description__trigram_contains')
+    list_filter = (('category', CategoryListFilter),)
     inlines = (ItemCoverInline, EntryInline)
+    autocomplete_fields = ('category',)
     list_per_page = 25
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('category').prefetch_related('entries',
+                                                                                         'category__names')
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'count_items', 'is_super', 'has_models')
+    search_fields = ['names__name']
+    autocomplete_fields = ['parent']
+    ordering = ['-pk']
     inlines = [CategoryNameInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('names').annotate(
+            subcategory_count=Count('subcategories'))
+
+    def is_super(self, category):
+        return category.subcategory_count > 0
+
+    is_super.boolean = True
+    is_super.short_description = "Имеет подкатегории?"
+    is_super.admin_order_field = 'subcategory_count'
+
 
 class MessageValueInline(admin.StackedInline):
     model = MessageValue
+    autocomplete_fields = ('language',)
     verbose_name = 'Перевод'
     verbose_name_plural = 'Переводы'
     extra = 0
@@ -88,6 +124,7 @@ class MessageValueInline(admin.StackedInline):
 
 class MessageDescriptionInline(admin.StackedInline):
     model = MessageDescription
+    autocomplete_fields = ('language',)
     verbose_name = 'Описание'
     verbose_name_plural = 'Описания'
     extra = 0
@@ -102,10 +139,57 @@ class MessageAdmin(admin.ModelAdmin):
 @admin.register(TelegramUser)
 class TelegramUserAdmin(admin.ModelAdmin):
     list_display = ['chat_id', 'full_name', 'real_name', 'username', 'phone', 'referrer', 'is_admin', 'is_manager']
-    search_fields = ['full_name', 'username']
+    # Substring lookups, PostgreSQL serves them from the trigram indexes of migration 0052
+    search_fields = ['username__trigram_contains', 'full_name__trigram_contains']
+    list_select_related = ['referrer']
+    autocomplete_fields = ['referrer']
+    ordering = ['-pk']
+
+    def get_search_results(self, request, queryset, search_term):
+        results, use_distinct = super().get_search_results(request, queryset, search_term)
+        term = search_term.strip()
+        # A number may also be a chat id, matched through its unique index
+        if term.isdigit() and int(term) < 2 ** 63:
+            results |= queryset.filter(chat_id=int(term))
+        return results, use_distinct
 
 
 @admin.register(MessageLanguage)
 class MessageLanguageAdmin(admin.ModelAdmin):
     list_display = ['name', 'default']
     search_fields = ['name']
+    ordering = ['name']
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'audience', 'language', 'status', 'total', 'sent', 'failed', 'created', 'finished']
+    list_filter = ['status']
+    readonly_fields = ['status', 'total', 'sent', 'failed', 'finished']
+    actions = ['start', 'pause', 'resume']
+
+    def start(self, request, queryset):
+        updated = queryset.filter(status=Broadcast.DRAFT).update(status=Broadcast.QUEUED)
+        self.message_user(request, f"Поставлено в очередь: {updated}")
+
+    start.short_description = 'Запустить рассылку'
+
+    def pause(self, request, queryset):
+        updated = queryset.filter(status=Broadcast.RUNNING).update(status=Broadcast.PAUSED)
+        self.message_user(request, f"Приостановлено: {updated}")
+
+    pause.short_description = 'Приостановить рассылку'
+
+    def resume(self, request, queryset):
+        updated = queryset.filter(status=Broadcast.PAUSED).update(status=Broadcast.RUNNING)
+        self.message_user(request, f"Возобновлено: {updated}")
+
+    resume.short_description = 'Возобновить рассылку'
+
+
+@admin.register(BroadcastRecipient)
+class BroadcastRecipientAdmin(admin.ModelAdmin):
+    list_display = ['user', 'broadcast', 'status', 'error', 'updated']
+    list_filter = ['status', 'broadcast']
+    list_select_related = ['user', 'broadcast__message']
+    raw_id_fields = ['user', 'broadcast']
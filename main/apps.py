@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     name = 'main'
     verbose_name = 'Главное'
+
+    def ready(self):
+        import main.postgres  # noqa: F401
+        import main.signals  # noqa: F401
@@ -0,0 +1,218 @@
+import datetime as dt
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction, IntegrityError
+from django.db.models import Count, Q
+from django.template import TemplateSyntaxError
+from django.utils import timezone
+from telegram import Bot, ParseMode
+from telegram.error import RetryAfter, Unauthorized, BadRequest, TelegramError
+from telegram.utils.request import Request
+
+from main.models import Broadcast, BroadcastRecipient, Message, MessageValue, Lease
+from main.rendering import render
+from main.translations import catalog
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows ``rate`` operations per second on average and bursts of up to ``capacity``.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self, seconds):
+        # Telegram asked us to back off: nobody sends until the debt is paid off
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+def hold_lease(name, holder, seconds):
+    """
+    Takes the lease ``name`` for ``holder`` or extends it, if it is free, held by ``holder``
+    already or expired. Tells whether ``holder`` has the lease for the next ``seconds``.
+    """
+    now = timezone.now()
+    expires = now + dt.timedelta(seconds=seconds)
+    if Lease.objects.filter(Q(holder=holder) | Q(expires__lt=now), name=name) \
+            .update(holder=holder, expires=expires):
+        return True
+    try:
+        with transaction.atomic():
+            Lease.objects.create(name=name, holder=holder, expires=expires)
+        return True
+    except IntegrityError:
+        # Held by another process
+        return False
+
+
+class Broadcaster:
+    """
+    Sends queued broadcasts from a background thread of the bot process.
+
+    Progress lives in ``BroadcastRecipient`` rows, so a restarted bot simply continues with
+    the pending ones. Every worker process runs a broadcaster, but only the one holding the
+    broadcast lease sends, so the bot as a whole stays at ``BROADCAST_RATE``. A lease of a process
+    that died expires after ``BROADCAST_LEASE_TIMEOUT``. A recipient is still claimed before its
+    message is sent, so a chat never gets the message twice when the lease changes hands; claims
+    of a process that died are released after ``BROADCAST_CLAIM_TIMEOUT``.
+
+    The broadcaster uses its own bot and connection pool, the handlers' bot is left to
+    django-telegrambot's message queue. Every chat receives one message per broadcast, which
+    keeps us within the per-chat limit as well.
+    """
+
+    lease_name = 'broadcasts'
+
+    def __init__(self, rate=None, batch_size=None, interval=None):
+        self.bucket = TokenBucket(rate or settings.BROADCAST_RATE)
+        self.batch_size = batch_size or settings.BROADCAST_BATCH
+        self.interval = interval or settings.BROADCAST_POLL_INTERVAL
+        self.bot = None
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._lease_renewal = 0.0
+        self._thread = None
+
+    def hold_lease(self):
+        # Renewed at half of its time, so it doesn't expire between two calls
+        if time.monotonic() < self._lease_renewal:
+            return True
+        if not hold_lease(self.lease_name, self.holder, settings.BROADCAST_LEASE_TIMEOUT):
+            return False
+        self._lease_renewal = time.monotonic() + settings.BROADCAST_LEASE_TIMEOUT / 2
+        return True
+
+    def prepare(self, broadcast):
+        users = broadcast.get_users().values_list('pk', flat=True)
+        BroadcastRecipient.objects.bulk_create(
+            (BroadcastRecipient(broadcast=broadcast, user_id=pk) for pk in users.iterator()),
+            batch_size=1000, ignore_conflicts=True)
+        Broadcast.objects.filter(pk=broadcast.pk, status=Broadcast.QUEUED).update(status=Broadcast.RUNNING)
+        self.update_counters(broadcast)
+
+    def update_counters(self, broadcast):
+        counters = broadcast.recipients.aggregate(
+            total=Count('pk'),
+            sent=Count('pk', filter=Q(status=BroadcastRecipient.SENT)),
+            failed=Count('pk', filter=Q(status=BroadcastRecipient.FAILED)),
+        )
+        Broadcast.objects.filter(pk=broadcast.pk).update(**counters)
+        return counters
+
+    def send(self, broadcast, recipient):
+        user = recipient.user
+        try:
+            text = render(Message.get(broadcast.message.name, catalog.get().get_language(user.language_id)),
+                          {'user': user})
+        except (MessageValue.DoesNotExist, TemplateSyntaxError) as e:
+            return BroadcastRecipient.FAILED, str(e)[:255]
+        while True:
+            self.bucket.acquire()
+            try:
+                self.bot.send_message(user.chat_id, text, parse_mode=ParseMode.HTML)
+                return BroadcastRecipient.SENT, ""
+            except RetryAfter as e:
+                logger.warning('Broadcast %s: flood limit, waiting %s seconds', broadcast.pk, e.retry_after)
+                self.bucket.drain(e.retry_after)
+            except (Unauthorized, BadRequest) as e:
+                return BroadcastRecipient.FAILED, str(e)[:255]
+            except TelegramError as e:
+                # Network trouble: leave the recipient for the next round
+                logger.warning('Broadcast %s: could not reach %s: %s', broadcast.pk, user.chat_id, e)
+                time.sleep(self.interval)
+                return BroadcastRecipient.PENDING, str(e)[:255]
+
+    def run_batch(self, broadcast):
+        recipients = list(broadcast.recipients.filter(status=BroadcastRecipient.PENDING)
+                          .select_related('user').order_by('pk')[:self.batch_size])
+        if not recipients:
+            return False
+        for recipient in recipients:
+            if not self.hold_lease():
+                break
+            # Another worker's broadcaster may have claimed the recipient since we read it
+            claimed = BroadcastRecipient.objects.filter(pk=recipient.pk, status=BroadcastRecipient.PENDING) \
+                .update(status=BroadcastRecipient.SENDING, updated=timezone.now())
+            if not claimed:
+                continue
+            status, error = self.send(broadcast, recipient)
+            BroadcastRecipient.objects.filter(pk=recipient.pk).update(status=status, error=error,
+                                                                      updated=timezone.now())
+        return True
+
+    def release_stale_claims(self):
+        # A message that was being sent when its worker stopped may or may not have arrived;
+        # sending it again is the lesser evil
+        BroadcastRecipient.objects.filter(
+            status=BroadcastRecipient.SENDING,
+            updated__lt=timezone.now() - dt.timedelta(seconds=settings.BROADCAST_CLAIM_TIMEOUT)
+        ).update(status=BroadcastRecipient.PENDING)
+
+    def run_once(self):
+        if not self.hold_lease():
+            return False
+        self.release_stale_claims()
+        for broadcast in Broadcast.objects.filter(status=Broadcast.QUEUED):
+            self.prepare(broadcast)
+
+        broadcast = Broadcast.objects.filter(status=Broadcast.RUNNING).select_related('message') \
+            .order_by('pk').first()
+        if broadcast is None:
+            return False
+
+        # One batch at a time, so pausing the broadcast takes effect quickly
+        if not self.run_batch(broadcast):
+            Broadcast.objects.filter(pk=broadcast.pk, status=Broadcast.RUNNING) \
+                .update(status=Broadcast.DONE, finished=timezone.now())
+        self.update_counters(broadcast)
+        return True
+
+    def _run_forever(self):
+        while True:
+            close_old_connections()
+            try:
+                busy = self.run_once()
+            except Exception:
+                logger.exception('Broadcast failed')
+                busy = False
+            if not busy:
+                time.sleep(self.interval)
+
+    def start(self, bot):
+        if self._thread is None:
+            self.bot = Bot(bot.token, request=Request(con_pool_size=2))
+            # Worker processes may be forked after the broadcaster was created
+            self.holder = f"{socket.gethostname()}:{os.getpid()}"
+            self._thread = threading.Thread(target=self._run_forever, name='broadcaster', daemon=True)
+            self._thread.start()
+
+
+broadcaster = Broadcaster()
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """
+    Read-only value built from the database and kept in process memory.
+
+    The value is built lazily on first access. ``invalidate()`` drops it, so the next
+    reader rebuilds it; ``refresh()`` rebuilds it in a background thread while readers keep
+    getting the previous value, and swaps it in one assignment once it is ready.
+
+    Once the value is older than ``ttl`` seconds it is refreshed in the background as well.
+    The ttl is a safety net for changes made by other processes (admin site vs. polling bot),
+    which never reach our signals.
+    """
+
+    def __init__(self, builder, ttl=None):
+        self._builder = builder
+        self._ttl = settings.CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._value = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._refreshing = False
+
+    def _expired(self):
+        return self._ttl > 0 and time.monotonic() - self._built_at > self._ttl
+
+    def _store(self, value, generation):
+        # Don't keep a value that was invalidated while it was being built
+        if generation != self._generation:
+            return False
+        self._value = value
+        self._built_at = time.monotonic()
+        return True
+
+    def get(self):
+        value = self._value
+        if value is None:
+            with self._lock:
+                value = self._value
+                if value is None:
+                    generation = self._generation
+                    value = self._builder()
+                    with self._state_lock:
+                        self._store(value, generation)
+        elif self._expired():
+            self._start_refresh()
+        return value
+
+    def peek(self):
+        """The current value without building it, None if it wasn't built yet."""
+        return self._value
+
+    def invalidate(self):
+        with self._state_lock:
+            self._generation += 1
+            self._value = None
+
+    def refresh(self):
+        with self._state_lock:
+            self._generation += 1
+        self._start_refresh()
+
+    def _start_refresh(self):
+        with self._state_lock:
+            if self._refreshing:
+                # The running rebuild notices the new generation and starts over
+                return
+            self._refreshing = True
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            while True:
+                generation = self._generation
+                value = self._builder()
+                with self._state_lock:
+                    if self._store(value, generation):
+                        self._refreshing = False
+                        return
+        except Exception:
+            logger.exception('Could not rebuild %s', getattr(self._builder, '__name__', self._builder))
+            with self._state_lock:
+                self._refreshing = False
+        finally:
+            connection.close()
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.conf import settings
+from telegram import InlineKeyboardMarkup
+
+
+@dataclass(frozen=True)
+class ItemCard:
+    text: str
+    keyboard: InlineKeyboardMarkup
+    has_covers: bool
+
+
+class ItemCards:
+    """
+    Rendered item cards per item and language.
+
+    A card is valid for the content versions of the catalog (texts, templates) and navigation
+    tree (categories, item order) it was rendered with; newer versions of either rebuild it on
+    the next view, periodic rebuilds of unchanged content don't. Changes
+    that neither of them sees, like entries and covers, drop the item's cards via ``invalidate()``.
+    """
+
+    def __init__(self, size=None):
+        self._size = settings.ITEM_CARD_CACHE_SIZE if size is None else size
+        self._lock = threading.Lock()
+        self._cards = OrderedDict()
+        self._generation = 0
+
+    def get(self, item_id, language_id, version, build):
+        with self._lock:
+            cards = self._cards.get(item_id)
+            entry = cards.get(language_id) if cards is not None else None
+            if entry is not None and entry[0] == version:
+                self._cards.move_to_end(item_id)
+                return entry[1]
+            generation = self._generation
+
+        card = build()
+        with self._lock:
+            # Don't keep a card that was invalidated while it was being built
+            if card is not None and generation == self._generation:
+                self._cards.setdefault(item_id, {})[language_id] = (version, card)
+                self._cards.move_to_end(item_id)
+                while len(self._cards) > self._size:
+                    self._cards.popitem(last=False)
+        return card
+
+    def invalidate(self, item_id):
+        with self._lock:
+            self._generation += 1
+            self._cards.pop(item_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cards.clear()
+
+
+cards = ItemCards()
@@ -0,0 +1,53 @@
+from django.utils.functional import cached_property
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from main.navigation import navigation
+from main.sessions import sessions
+from main.translations import catalog
+
+
+class RequestContext:
+    """
+    State shared by every handler and helper that runs for one update.
+    """
+
+    def __init__(self, user, created):
+        self.user = user
+        self.created = created
+        self.catalog = catalog.get()
+
+        if user.language_id is not None:
+            # Reuse the catalog's language object instead of a lazy FK query
+            language = self.catalog.get_language(user.language_id)
+            if language is not None:
+                user.language = language
+
+    @property
+    def language(self):
+        return self.user.language if self.user.language_id is not None else self.default_language
+
+    @property
+    def default_language(self):
+        return self.catalog.default_language
+
+    @cached_property
+    def navigation(self):
+        return navigation.get()
+
+
+def get_request(update: Update, context: CallbackContext) -> RequestContext:
+    request = getattr(context, 'request', None)
+    if request is None:
+        user, created = sessions.resolve(
+            update.effective_chat.id,
+            update.effective_user.full_name,
+            update.effective_user.username if update.effective_user.username is not None else ''
+        )
+        request = context.request = RequestContext(user, created)
+    return request
+
+
+def bind_request(update: Update, context: CallbackContext):
+    if update.effective_chat is not None and update.effective_user is not None:
+        get_request(update, context)
@@ -0,0 +1,68 @@
+from django.db import connection
+from django.db.models import F, Sum
+
+from main.models import Category, Item
+
+# Guards the recursive queries against cycles in Category.parent
+MAX_DEPTH = 32
+
+
+def get_ancestors(category_id):
+    ancestors = []
+    while category_id is not None and category_id not in ancestors and len(ancestors) < MAX_DEPTH:
+        ancestors.append(category_id)
+        category_id = Category.objects.filter(pk=category_id).values_list('parent_id', flat=True).first()
+    return ancestors
+
+
+def add_items(category_id, delta):
+    if category_id is None or not delta:
+        return
+    Category.objects.filter(pk=category_id).update(direct_items=F('direct_items') + delta)
+    Category.objects.filter(pk__in=get_ancestors(category_id)).update(total_items=F('total_items') + delta)
+
+
+def recount_ancestors(category_id):
+    """Recomputes total_items of a category and its ancestors from their children, bottom up."""
+    for pk in get_ancestors(category_id):
+        children = Category.objects.filter(parent_id=pk).aggregate(total=Sum('total_items'))['total'] or 0
+        Category.objects.filter(pk=pk).update(total_items=F('direct_items') + children)
+
+
+def move_category(category_id, old_parent_id, new_parent_id):
+    total = Category.objects.filter(pk=category_id).values_list('total_items', flat=True).first()
+    if total:
+        Category.objects.filter(pk__in=get_ancestors(old_parent_id)).update(total_items=F('total_items') - total)
+        Category.objects.filter(pk__in=get_ancestors(new_parent_id)).update(total_items=F('total_items') + total)
+
+
+RECOUNT_SQL = f'''
+WITH RECURSIVE ancestry (category_id, ancestor_id, depth) AS (
+    SELECT id, id, 0 FROM {Category._meta.db_table}
+    UNION ALL
+    SELECT ancestry.category_id, category.parent_id, ancestry.depth + 1
+    FROM ancestry JOIN {Category._meta.db_table} category ON category.id = ancestry.ancestor_id
+    WHERE category.parent_id IS NOT NULL AND ancestry.depth < {MAX_DEPTH}
+)
+SELECT ancestry.ancestor_id,
+       SUM(CASE WHEN ancestry.ancestor_id = ancestry.category_id THEN 1 ELSE 0 END),
+       COUNT(*)
+FROM ancestry JOIN {Item._meta.db_table} item ON item.category_id = ancestry.category_id
+GROUP BY ancestry.ancestor_id
+'''
+
+
+def recount_items():
+    with connection.cursor() as cursor:
+        cursor.execute(RECOUNT_SQL)
+        counts = {pk: (direct, total) for pk, direct, total in cursor.fetchall()}
+
+    categories = list(Category.objects.only('pk', 'direct_items', 'total_items'))
+    changed = []
+    for category in categories:
+        direct, total = counts.get(category.pk, (0, 0))
+        if (category.direct_items, category.total_items) != (direct, total):
+            category.direct_items, category.total_items = direct, total
+            changed.append(category)
+    Category.objects.bulk_update(changed, ['direct_items', 'total_items'], batch_size=500)
+    return len(changed)
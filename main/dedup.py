@@ -0,0 +1,89 @@
+import datetime as dt
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from main.models import ProcessedUpdate
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateWindow:
+    """
+    Drops updates that Telegram delivers to the webhook more than once.
+
+    Recent update ids are kept in process memory; the ``ProcessedUpdate`` table shares them
+    between worker processes, its unique index decides which process gets to handle an update.
+    Rows older than ``ttl`` seconds are deleted once per ``ttl``.
+    """
+
+    def __init__(self, size=None, ttl=None):
+        self._size = settings.UPDATE_DEDUP_SIZE if size is None else size
+        self._ttl = settings.UPDATE_DEDUP_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self._pruned_at = time.monotonic()
+        self.dropped = 0
+
+    def _remember(self, update_id):
+        now = time.monotonic()
+        with self._lock:
+            self._seen[update_id] = now
+            while len(self._seen) > self._size:
+                self._seen.popitem(last=False)
+
+    def _is_recent(self, update_id):
+        with self._lock:
+            seen_at = self._seen.get(update_id)
+            return seen_at is not None and time.monotonic() - seen_at <= self._ttl
+
+    def _drop(self, update_id):
+        with self._lock:
+            self.dropped += 1
+        logger.info('Dropped duplicate update %s', update_id)
+        return True
+
+    def is_duplicate(self, update_id, shared=True):
+        if self._is_recent(update_id):
+            return self._drop(update_id)
+        if not shared:
+            self._remember(update_id)
+            return False
+        try:
+            with transaction.atomic():
+                ProcessedUpdate.objects.create(update_id=update_id)
+        except IntegrityError:
+            self._remember(update_id)
+            return self._drop(update_id)
+        self._remember(update_id)
+        self.prune()
+        return False
+
+    def prune(self):
+        with self._lock:
+            if time.monotonic() - self._pruned_at < self._ttl:
+                return
+            self._pruned_at = time.monotonic()
+        ProcessedUpdate.objects.filter(received__lt=timezone.now() - dt.timedelta(seconds=self._ttl)).delete()
+
+    def attach(self, dispatcher):
+        """Makes ``dispatcher`` skip the updates it has already seen."""
+        process_update = dispatcher.process_update
+
+        def process_new_update(update):
+            update_id = getattr(update, 'update_id', None)
+            # Inline queries arrive on every keystroke and answering one twice is harmless
+            shared = getattr(update, 'inline_query', None) is None
+            if update_id is not None and self.is_duplicate(update_id, shared):
+                return
+            process_update(update)
+
+        dispatcher.process_update = process_new_update
+
+
+updates = UpdateWindow()
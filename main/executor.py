@@ -0,0 +1,87 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+def get_chat_key(update):
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    return None
+
+
+class ChatExecutor:
+    """
+    Runs updates on a pool of worker threads: in parallel across chats, strictly in order
+    within a chat.
+
+    Every chat has its own queue. A worker takes one update from it and then puts the chat
+    back at the end of the pool's queue, so a busy chat can't hold a worker for long. At most
+    ``queue_size`` updates wait or run at once; ``submit()`` blocks beyond that, which in turn
+    stops the update fetcher.
+    """
+
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or settings.BOT_WORKERS
+        self.queue_size = queue_size or settings.BOT_QUEUE_SIZE
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='bot-worker')
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._lock = threading.Lock()
+        self._chats = {}
+
+    def submit(self, key, func, *args):
+        self._slots.acquire()
+        with self._lock:
+            tasks = self._chats.get(key)
+            if tasks is not None:
+                # The chat is already scheduled, its worker picks the task up in turn
+                tasks.append((func, args))
+                return
+            self._chats[key] = deque([(func, args)])
+        self._pool.submit(self._run_next, key)
+
+    def _run_next(self, key):
+        with self._lock:
+            func, args = self._chats[key][0]
+        close_old_connections()
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Could not process update')
+        finally:
+            close_old_connections()
+            self._slots.release()
+
+        with self._lock:
+            tasks = self._chats[key]
+            tasks.popleft()
+            if not tasks:
+                del self._chats[key]
+                return
+        self._pool.submit(self._run_next, key)
+
+    def attach(self, dispatcher, updater=None):
+        """
+        Makes ``dispatcher`` hand its updates over to the executor, both from the polling
+        updater and from the webhook view.
+        """
+        process_update = dispatcher.process_update
+
+        def submit_update(update):
+            self.submit(get_chat_key(update), process_update, update)
+
+        dispatcher.process_update = submit_update
+
+        if updater is not None:
+            # Without a bound the fetcher would keep downloading updates we can't process
+            updater.update_queue = dispatcher.update_queue = Queue(self.queue_size)
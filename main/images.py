@@ -0,0 +1,107 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+
+from main.models import Cover, CoverRendition
+from main.renditions import RENDITIONS, render_renditions
+
+logger = logging.getLogger(__name__)
+
+
+def get_rendition_name(cover, kind):
+    stem, _ = os.path.splitext(os.path.basename(cover.file.name))
+    return os.path.join('covers', 'renditions', f"{stem}_{kind}.{RENDITIONS[kind][1]}")
+
+
+class CoverPipeline:
+    """
+    Produces cover renditions in a pool of worker processes.
+
+    Processing is idempotent: renditions that already exist for the current file
+    of a cover are skipped, so a failed or interrupted run can simply be repeated.
+
+    Workers are spawned rather than forked, the web and bot processes run threads that a fork
+    would copy in whatever state they are. Renditions are saved by a single thread of our own.
+    """
+
+    def __init__(self, workers=None):
+        self._workers = workers
+        self._executor = None
+        self._saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cover-renditions')
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self._workers or settings.IMAGE_WORKERS,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def get_missing(self, cover, force=False):
+        existing = {rendition.kind: rendition for rendition in cover.renditions.all()}
+        return [
+            kind for kind in RENDITIONS
+            if force or kind not in existing or existing[kind].source != cover.file.name
+            or not default_storage.exists(existing[kind].file.name)
+        ]
+
+    def submit(self, cover: Cover, force=False) -> Future:
+        """
+        Schedules processing of a cover, the future resolves to the saved renditions.
+        """
+        result = Future()
+        kinds = self.get_missing(cover, force)
+        if not kinds:
+            result.set_result([])
+            return result
+
+        targets = {kind: default_storage.path(get_rendition_name(cover, kind)) for kind in kinds}
+        job = self.executor.submit(render_renditions, cover.file.path, cover.compress, targets)
+
+        def save():
+            close_old_connections()
+            try:
+                result.set_result(self.save_renditions(cover, job.result()))
+            except Exception as e:
+                logger.exception('Could not process cover %s', cover.pk)
+                result.set_exception(e)
+            finally:
+                close_old_connections()
+
+        job.add_done_callback(lambda job: self._saver.submit(save))
+        return result
+
+    def save_renditions(self, cover, results):
+        current = Cover.objects.filter(pk=cover.pk).values_list('file', flat=True).first()
+        if current != cover.file.name:
+            # The cover was replaced or deleted while it was processed
+            for kind in results:
+                default_storage.delete(get_rendition_name(cover, kind))
+            return []
+
+        renditions = []
+        for kind, (width, height, size) in results.items():
+            name = get_rendition_name(cover, kind)
+            old = CoverRendition.objects.filter(cover=cover, kind=kind).values_list('file', flat=True).first()
+            rendition, _ = CoverRendition.objects.update_or_create(cover=cover, kind=kind, defaults={
+                'file': name,
+                'source': cover.file.name,
+                'width': width,
+                'height': height,
+                'size': size,
+                'telegram_file_id': "",
+            })
+            if old and old != name:
+                default_storage.delete(old)
+            renditions.append(rendition)
+        return renditions
+
+
+pipeline = CoverPipeline()
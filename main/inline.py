@@ -0,0 +1,112 @@
+import html
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.html import strip_tags
+from telegram import InlineQueryResultCachedPhoto, InlineQueryResultPhoto, InlineQueryResultArticle, \
+    InputTextMessageContent, ParseMode
+
+from main.cache import Snapshot
+from main.models import Entry, Cover, CoverRendition, Message
+from main.rendering import render
+from main.translations import catalog
+
+# Telegram rejects photo captions longer than this
+CAPTION_LENGTH = 1024
+
+
+def get_public_url(photo):
+    return settings.WEBSITE_LINK + photo.file.url
+
+
+def fit_caption(caption):
+    """Returns the caption and its parse mode, as cut plain text if the rendered caption is too long."""
+    if len(caption) <= CAPTION_LENGTH:
+        return caption, ParseMode.HTML
+    text = html.unescape(strip_tags(caption))
+    if len(text) > CAPTION_LENGTH:
+        text = text[:CAPTION_LENGTH - 1].rstrip() + '…'
+    return text, None
+
+
+class InlineCatalog:
+    """
+    Everything inline query results are built from, loaded with a few bulk queries.
+
+    Results are built from memory on first use and kept per language and item until the
+    catalog, the translations or the navigation tree change, so answering a keystroke never
+    touches the database.
+    """
+
+    def __init__(self, entries, covers):
+        # (language_id, item_id) -> entries of the item, first entry first
+        self._entries = entries
+        # item_id -> photo of the item's first cover and its thumbnail
+        self._covers = covers
+        self._lock = threading.Lock()
+        self._results = {}
+
+    def get_result(self, language, item_id, tree):
+        language_id = language.pk if language is not None else None
+        entries = self._entries.get((language_id, item_id))
+        category = tree.get_item_category(item_id)
+        if not entries or category is None:
+            return None
+
+        version = (catalog.get().version, tree.version)
+        key = (language_id, item_id)
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        result = self._build_result(language, item_id, category, entries)
+        with self._lock:
+            self._results[key] = (version, result)
+        return result
+
+    def _build_result(self, language, item_id, category, entries):
+        caption = render(Message.get('inline_item', language), {'entries': entries})
+        title = entries[0]['description'] or category.get_item_label(item_id, language)
+        description = entries[0]['long_description']
+
+        if item_id not in self._covers:
+            return InlineQueryResultArticle(
+                id=str(item_id), title=title, description=description,
+                input_message_content=InputTextMessageContent(caption, parse_mode=ParseMode.HTML))
+
+        caption, parse_mode = fit_caption(caption)
+        photo, thumbnail = self._covers[item_id]
+        if photo.telegram_file_id:
+            return InlineQueryResultCachedPhoto(
+                id=str(item_id), photo_file_id=photo.telegram_file_id, title=title, description=description,
+                caption=caption, parse_mode=parse_mode)
+
+        return InlineQueryResultPhoto(
+            id=str(item_id), photo_url=get_public_url(photo), thumb_url=get_public_url(thumbnail),
+            photo_width=getattr(photo, 'width', None), photo_height=getattr(photo, 'height', None),
+            title=title, description=description, caption=caption, parse_mode=parse_mode)
+
+
+def load_inline_catalog():
+    entries = defaultdict(list)
+    for entry in Entry.objects.order_by('pk').values('item_id', 'language_id', 'description', 'long_description',
+                                                     'price', 'currency', 'show_price').iterator():
+        entries[entry['language_id'], entry['item_id']].append(entry)
+
+    renditions = defaultdict(dict)
+    for rendition in CoverRendition.objects.filter(
+            cover__item__isnull=False, kind__in=[CoverRendition.TELEGRAM, CoverRendition.THUMBNAIL]).iterator():
+        renditions[rendition.cover_id][rendition.kind] = rendition
+
+    covers = {}
+    for cover in Cover.objects.filter(item__isnull=False).order_by('pk').iterator():
+        if cover.item_id not in covers:
+            kinds = renditions.get(cover.pk, {})
+            photo = kinds.get(CoverRendition.TELEGRAM, cover)
+            covers[cover.item_id] = (photo, kinds.get(CoverRendition.THUMBNAIL, photo))
+    return InlineCatalog(dict(entries), covers)
+
+
+inline_catalog = Snapshot(load_inline_catalog, ttl=settings.SEARCH_INDEX_TTL)
@@ -0,0 +1,136 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from main.models import TelegramUser
+from main.navigation import navigation
+from main.rendering import warm_up_templates
+from main.testing import seed_catalog, make_dispatcher, UpdateFactory
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = "Replay typical user flows through the bot's dispatcher on a test database and report throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sections', type=int, default=2, help="Super categories in the catalog")
+        parser.add_argument('--categories', type=int, default=5, help="Categories per super category")
+        parser.add_argument('--items', type=int, default=50, help="Items per category")
+        parser.add_argument('--users', type=int, default=1000, help="Registered users")
+        parser.add_argument('--chats', type=int, default=20, help="Chats replaying the flows")
+        parser.add_argument('--rounds', type=int, default=5, help="Times every chat replays the flows")
+        parser.add_argument('--output', default='benchmark.json', help="File the results are written to")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+
+        for name, flow in results['flows'].items():
+            self.stdout.write(f"{name:>10}: {flow['updates_per_second']:8.1f} updates/s, "
+                              f"p50 {flow['p50_ms']:6.2f} ms, p99 {flow['p99_ms']:6.2f} ms, "
+                              f"{flow['queries_per_update']:5.2f} queries/update")
+        total = results['total']
+        self.stdout.write(f"{'total':>10}: {total['updates_per_second']:8.1f} updates/s, "
+                          f"{total['queries_per_update']:5.2f} queries/update")
+        for error in results['errors']:
+            self.stderr.write(f"Handler failed: {error}")
+        self.stdout.write(f"Results written to {options['output']}")
+
+    def run(self, options):
+        seed_catalog(sections=options['sections'], categories=options['categories'], items=options['items'],
+                     users=options['users'])
+        warm_up_templates()
+
+        dispatcher = make_dispatcher()
+        errors = []
+        dispatcher.error_handlers.clear()
+        dispatcher.add_error_handler(lambda update, context: errors.append(repr(context.error)))
+        factory = UpdateFactory(dispatcher.bot)
+        tree = navigation.get()
+        section = next(node for node in tree.menu if getattr(node, 'children', None))
+        categories = [tree.get_category(pk) for pk in section.children]
+        listed = next(category for category in categories if category.has_models)
+        browsed = next(category for category in categories if category.item_ids)
+        info = next(node for node in tree.menu if not hasattr(node, 'children'))
+        admin = TelegramUser.objects.filter(is_admin=True).values_list('chat_id', flat=True).first()
+        chats = list(TelegramUser.objects.filter(is_admin=False).order_by('pk')
+                     .values_list('chat_id', flat=True)[:options['chats']])
+        new_chats = iter(range(10 ** 9, 2 * 10 ** 9))
+
+        def onboarding(chat_id):
+            chat_id = next(new_chats)
+            return [factory.message(chat_id, '/start'), factory.message(chat_id, 'ru'),
+                    factory.message(chat_id, 'Benchmark User'), factory.contact(chat_id, '+998901234567')]
+
+        def item_browsing(chat_id):
+            first, second = browsed.item_ids[0], browsed.item_ids[1 % len(browsed.item_ids)]
+            return [factory.callback(chat_id, f"items,{browsed.id},begin"),
+                    factory.callback(chat_id, f"items,{browsed.id},next,{first}"),
+                    factory.callback(chat_id, f"items,{browsed.id},prev,{second}")]
+
+        flows = {
+            'onboarding': onboarding,
+            'menu': lambda chat_id: [factory.callback(chat_id, 'menu')],
+            'submenu': lambda chat_id: [factory.callback(chat_id, section.callback_data)],
+            'list': lambda chat_id: [factory.callback(chat_id, f"items,{listed.id},list")],
+            'item': item_browsing,
+            'info': lambda chat_id: [factory.callback(chat_id, info.callback_data)],
+            'search': lambda chat_id: [factory.message(chat_id, '/search item description')],
+            'stats': lambda chat_id: [factory.message(admin, '/stats')],
+        }
+
+        timings = {name: [] for name in flows}
+        queries = {name: 0 for name in flows}
+        for _ in range(options['rounds']):
+            for name, flow in flows.items():
+                for chat_id in chats:
+                    for update in flow(chat_id):
+                        counter = QueryCounter()
+                        start = time.perf_counter()
+                        with connection.execute_wrapper(counter):
+                            dispatcher.process_update(update)
+                        timings[name].append(time.perf_counter() - start)
+                        queries[name] += counter.queries
+
+        def summary(durations, query_count):
+            return {
+                'updates': len(durations),
+                'updates_per_second': len(durations) / sum(durations),
+                'mean_ms': statistics.mean(durations) * 1000,
+                'p50_ms': percentile(durations, 0.5) * 1000,
+                'p99_ms': percentile(durations, 0.99) * 1000,
+                'queries_per_update': query_count / len(durations),
+            }
+
+        return {
+            'date': timezone.now().isoformat(),
+            'options': {key: options[key] for key in ('sections', 'categories', 'items', 'users', 'chats', 'rounds')},
+            'database': connection.vendor,
+            'bot_api_calls': len(dispatcher.bot.calls),
+            'errors': errors[:10],
+            'flows': {name: summary(timings[name], queries[name]) for name in flows},
+            'total': summary([t for durations in timings.values() for t in durations], sum(queries.values())),
+        }
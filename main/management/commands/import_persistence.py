@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from telegram.ext import PicklePersistence
+
+from main.persistence import import_states
+
+
+class Command(BaseCommand):
+    help = "Copy conversations and user_data of a PicklePersistence file into the database, once after switching"
+
+    def add_arguments(self, parser):
+        parser.add_argument('filename', help="File name the PicklePersistence was created with")
+        parser.add_argument('--split', action='store_true',
+                            help="The persistence kept separate _user_data and _conversations files")
+
+    def handle(self, *args, **options):
+        persistence = PicklePersistence(options['filename'], store_chat_data=False, single_file=not options['split'])
+        user_data = persistence.get_user_data()
+        # Loads every conversation, not only the named one
+        persistence.get_conversations('')
+        states, users = import_states(persistence.conversations or {}, user_data)
+        self.stdout.write(f"Imported {states} conversation states and user_data of {users} users")
@@ -0,0 +1,28 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from main.images import CoverPipeline
+from main.models import Cover
+
+
+class Command(BaseCommand):
+    help = "Create missing renditions of all covers in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Recreate renditions that already exist")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes, IMAGE_WORKERS by default")
+
+    def handle(self, *args, **options):
+        pipeline = CoverPipeline(options['workers'])
+        covers = Cover.objects.exclude(file="").prefetch_related('renditions').order_by('pk')
+
+        futures = {pipeline.submit(cover, options['force']): cover for cover in covers}
+        failed = 0
+        for done, future in enumerate(as_completed(futures), 1):
+            cover = futures[future]
+            if future.exception() is not None:
+                failed += 1
+                self.stderr.write(f"Cover {cover.pk} ({cover.file.name}): {future.exception()}")
+            if done % 10 == 0 or done == len(futures):
+                self.stdout.write(f"Processed {done}/{len(futures)} covers, {failed} failed")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from main.persistence import prune_conversations
+
+
+class Command(BaseCommand):
+    help = "Delete conversations that users abandoned"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Age of the last change, CONVERSATION_TTL_DAYS by default")
+
+    def handle(self, *args, **options):
+        deleted = prune_conversations(options['days'])
+        self.stdout.write(f"Deleted {deleted} conversations")
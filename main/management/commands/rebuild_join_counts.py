@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.stats import rebuild_join_counts
+
+
+class Command(BaseCommand):
+    help = "Rebuild daily join counts per referrer and language from the users table"
+
+    def handle(self, *args, **options):
+        rows = rebuild_join_counts()
+        self.stdout.write(f"Created {rows} daily join counts")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.counters import recount_items
+
+
+class Command(BaseCommand):
+    help = "Rebuild direct and subtree item counters of all categories"
+
+    def handle(self, *args, **options):
+        changed = recount_items()
+        self.stdout.write(f"Updated counters of {changed} categories")
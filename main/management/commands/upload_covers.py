@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django_telegrambot.apps import DjangoTelegramBot
+
+from main.models import Cover
+from main.telegrambot import chunks, get_cover_media, get_photo, remember_file_ids
+
+
+class Command(BaseCommand):
+    help = "Upload covers to a private chat, so that the bot can send them by Telegram file_id"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat', type=int, default=settings.ADMIN_CHAT_ID,
+                            help="Chat to upload to, ADMIN_CHAT_ID by default")
+        parser.add_argument('--all', action='store_true', help="Upload covers that already have a file_id as well")
+        parser.add_argument('--delay', type=float, default=3.0, help="Seconds between albums")
+
+    def handle(self, *args, **options):
+        if not options['chat']:
+            raise CommandError("Set ADMIN_CHAT_ID or pass --chat")
+
+        bot = DjangoTelegramBot.get_bot()
+        covers = Cover.objects.prefetch_related('renditions').order_by('pk')
+        if not options['all']:
+            covers = [cover for cover in covers if not get_photo(cover).telegram_file_id]
+
+        covers = list(covers)
+        for done, chunk in enumerate(chunks(covers, 10), 1):
+            for cover in chunk:
+                get_photo(cover).telegram_file_id = ""
+            messages = bot.send_media_group(options['chat'], [get_cover_media(cover) for cover in chunk],
+                                            disable_notification=True)
+            remember_file_ids(chunk, messages)
+            self.stdout.write(f"Uploaded {min(done * 10, len(covers))}/{len(covers)} covers")
+            time.sleep(options['delay'])
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.db import connection
+from telegram.error import RetryAfter, TimedOut
+from telegram.ext import ConversationHandler
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+def format_value(value):
+    return "+Inf" if value == float('inf') else repr(float(value))
+
+
+class Metrics:
+    """
+    Counters and histograms kept in process memory and rendered in the Prometheus text format.
+
+    Histograms have fixed buckets, so memory only grows with the number of label values
+    (handlers and Bot API methods), never with traffic.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._types = {}
+        self._collectors = []
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._types.setdefault(name, 'counter')
+            self._counters[name, labels] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            self._types.setdefault(name, 'histogram')
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-1] += value
+
+    def collect(self, name, getter):
+        """Registers a counter whose value is read from ``getter`` at render time."""
+        self._collectors.append((name, getter))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+            types = dict(self._types)
+
+        for name, getter in self._collectors:
+            lines += [f"# TYPE {name} counter", f"{name} {format_value(getter())}"]
+
+        for metric, kind in sorted(types.items()):
+            lines.append(f"# TYPE {metric} {kind}")
+            if kind == 'counter':
+                for (name, labels), value in sorted(counters.items()):
+                    if name == metric:
+                        lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                continue
+            for (name, labels), histogram in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram[-1])}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram[-2]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class QueryTimer:
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += time.perf_counter() - start
+
+
+def measure_handler(callback):
+    """Records wall time, number of queries and database time of a handler callback."""
+    labels = (('handler', callback.__name__),)
+
+    @wraps(callback)
+    def measured(update, context, *args, **kwargs):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                return callback(update, context, *args, **kwargs)
+        finally:
+            metrics.observe('bot_handler_seconds', labels, time.perf_counter() - start)
+            metrics.inc('bot_handler_queries_total', labels, timer.queries)
+            metrics.inc('bot_handler_db_seconds_total', labels, timer.duration)
+
+    measured.measured = True
+    return measured
+
+
+def measure_handlers(handlers):
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            measure_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                measure_handlers(state_handlers)
+            measure_handlers(handler.fallbacks)
+        elif not getattr(handler.callback, 'measured', False):
+            handler.callback = measure_handler(handler.callback)
+
+
+def measure_dispatcher(dispatcher):
+    for handlers in dispatcher.handlers.values():
+        measure_handlers(handlers)
+
+
+def measure_bot(bot):
+    """Records latency of every Bot API call, flood limits and timeouts by method."""
+    request = bot._request
+    post = request.post
+
+    def measured_post(url, *args, **kwargs):
+        labels = (('method', url.rsplit('/', 1)[-1]),)
+        start = time.perf_counter()
+        try:
+            return post(url, *args, **kwargs)
+        except RetryAfter:
+            metrics.inc('bot_api_flood_limits_total', labels)
+            raise
+        except TimedOut:
+            metrics.inc('bot_api_timeouts_total', labels)
+            raise
+        finally:
+            metrics.observe('bot_api_seconds', labels, time.perf_counter() - start)
+
+    request.post = measured_post
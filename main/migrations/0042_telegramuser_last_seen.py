@@ -0,0 +1,18 @@
+# Generated by Django 3.0.6 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0041_auto_20200703_2151'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegramuser',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последняя активность'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.0.6 on 2026-10-18 17:56
+
+from django.db import migrations, models
+
+
+def count_items(apps, schema_editor):
+    Category = apps.get_model('main', 'Category')
+    Item = apps.get_model('main', 'Item')
+
+    parents = dict(Category.objects.values_list('pk', 'parent_id'))
+    direct = {pk: 0 for pk in parents}
+    total = {pk: 0 for pk in parents}
+    for category_id in Item.objects.values_list('category_id', flat=True):
+        direct[category_id] += 1
+        seen = set()
+        while category_id is not None and category_id not in seen:
+            seen.add(category_id)
+            total[category_id] += 1
+            category_id = parents[category_id]
+
+    for pk in parents:
+        Category.objects.filter(pk=pk).update(direct_items=direct[pk], total_items=total[pk])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0042_telegramuser_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='direct_items',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров в категории'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров с подкатегориями'),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.6 on 2026-10-18 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0043_auto_20261018_2256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cover',
+            name='telegram_file_id',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Telegram file_id'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.6 on 2026-10-18 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0044_cover_telegram_file_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('telegram', 'Для Telegram'), ('thumbnail', 'Миниатюра'), ('webp', 'WebP')], max_length=16, verbose_name='Тип')),
+                ('file', models.ImageField(max_length=255, upload_to='', verbose_name='Файл')),
+                ('source', models.CharField(help_text='Файл обложки, из которого получена копия', max_length=255, verbose_name='Исходный файл')),
+                ('width', models.PositiveIntegerField(verbose_name='Ширина')),
+                ('height', models.PositiveIntegerField(verbose_name='Высота')),
+                ('size', models.PositiveIntegerField(verbose_name='Размер, байт')),
+                ('telegram_file_id', models.CharField(blank=True, default='', max_length=255, verbose_name='Telegram file_id')),
+                ('cover', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='main.Cover', verbose_name='Обложка')),
+            ],
+            options={
+                'verbose_name': 'Копия обложки',
+                'verbose_name_plural': 'Копии обложки',
+                'unique_together': {('cover', 'kind')},
+            },
+        ),
+    ]
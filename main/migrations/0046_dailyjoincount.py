@@ -0,0 +1,43 @@
+# Generated by Django 3.0.6 on 2026-10-18 18:01
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def count_joins(apps, schema_editor):
+    TelegramUser = apps.get_model('main', 'TelegramUser')
+    DailyJoinCount = apps.get_model('main', 'DailyJoinCount')
+
+    rows = TelegramUser.objects.order_by().annotate(
+        date=TruncDate('joined', tzinfo=timezone.get_current_timezone())
+    ).values('date', 'referrer_id', 'language_id').annotate(count=Count('pk'))
+    DailyJoinCount.objects.bulk_create([DailyJoinCount(**row) for row in rows], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0045_coverrendition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyJoinCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+                ('language', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_joins', to='main.MessageLanguage', verbose_name='Язык')),
+                ('referrer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_joins', to='main.TelegramUser', verbose_name='Реферер')),
+            ],
+            options={
+                'verbose_name': 'Регистрации за день',
+                'verbose_name_plural': 'Регистрации по дням',
+                'unique_together': {('date', 'referrer', 'language')},
+            },
+        ),
+        migrations.RunPython(count_joins, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.6 on 2026-10-18 18:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0046_dailyjoincount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('audience', models.CharField(choices=[('all', 'Все пользователи'), ('managers', 'Менеджеры'), ('admins', 'Администраторы')], default='all', max_length=16, verbose_name='Получатели')),
+                ('status', models.CharField(choices=[('draft', 'Черновик'), ('queued', 'В очереди'), ('running', 'Отправляется'), ('paused', 'Приостановлена'), ('done', 'Завершена')], db_index=True, default='draft', max_length=16, verbose_name='Статус')),
+                ('total', models.PositiveIntegerField(default=0, editable=False, verbose_name='Получателей')),
+                ('sent', models.PositiveIntegerField(default=0, editable=False, verbose_name='Отправлено')),
+                ('failed', models.PositiveIntegerField(default=0, editable=False, verbose_name='Ошибок')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('finished', models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Завершена')),
+                ('language', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='broadcasts', to='main.MessageLanguage', verbose_name='Только на языке')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='broadcasts', to='main.Message', verbose_name='Сообщение')),
+            ],
+            options={
+                'verbose_name': 'Рассылка',
+                'verbose_name_plural': 'Рассылки',
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastRecipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('sending', 'Отправляется'), ('sent', 'Отправлено'), ('failed', 'Ошибка')], default='pending', max_length=16, verbose_name='Статус')),
+                ('error', models.CharField(blank=True, default='', max_length=255, verbose_name='Ошибка')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='main.Broadcast', verbose_name='Рассылка')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcasts', to='main.TelegramUser', verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Получатель',
+                'verbose_name_plural': 'Получатели',
+                'unique_together': {('broadcast', 'user')},
+                'index_together': {('broadcast', 'status')},
+            },
+        ),
+    ]
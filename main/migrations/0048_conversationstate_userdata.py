@@ -0,0 +1,41 @@
+# Generated by Django 3.0.6 on 2026-10-18 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0047_broadcast_broadcastrecipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(unique=True, verbose_name='ID пользователя')),
+                ('data', models.TextField(default='{}', verbose_name='Данные')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Данные пользователя',
+                'verbose_name_plural': 'Данные пользователей',
+            },
+        ),
+        migrations.CreateModel(
+            name='ConversationState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, verbose_name='Диалог')),
+                ('key', models.CharField(max_length=64, verbose_name='Ключ')),
+                ('state', models.TextField(verbose_name='Состояние')),
+                ('updated', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Состояние диалога',
+                'verbose_name_plural': 'Состояния диалогов',
+                'unique_together': {('name', 'key')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.6 on 2026-10-18 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0048_conversationstate_userdata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('update_id', models.BigIntegerField(unique=True, verbose_name='ID обновления')),
+                ('received', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Получено')),
+            ],
+            options={
+                'verbose_name': 'Обработанное обновление',
+                'verbose_name_plural': 'Обработанные обновления',
+            },
+        ),
+    ]
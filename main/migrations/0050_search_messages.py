@@ -0,0 +1,35 @@
+from django.db import migrations
+
+MESSAGES = {
+    'search_prompt': "Введите название или описание модели, которую ищете",
+    'search_results': "Результаты поиска «{{ query }}», {{ start }}–{{ end }}",
+    'search_nothing_found': "По запросу «{{ query }}» ничего не найдено",
+}
+
+
+def create_messages(apps, schema_editor):
+    Message = apps.get_model('main', 'Message')
+    MessageLanguage = apps.get_model('main', 'MessageLanguage')
+    MessageValue = apps.get_model('main', 'MessageValue')
+
+    # The texts are Russian, other languages are left for the admins to fill in
+    language = MessageLanguage.objects.filter(name='ru').first()
+    for name, text in MESSAGES.items():
+        message, created = Message.objects.get_or_create(name=name)
+        if created and language is not None:
+            MessageValue.objects.create(message=message, language=language, text=text)
+
+
+def delete_messages(apps, schema_editor):
+    apps.get_model('main', 'Message').objects.filter(name__in=MESSAGES).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0049_processedupdate'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_messages, delete_messages),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+TEXT = ("{% for entry in entries %}<b>{{ entry.description }}</b>\n"
+        "{% if entry.show_price %}{{ entry.price }} {{ entry.currency }}\n{% endif %}"
+        "{{ entry.long_description }}\n{% endfor %}")
+
+
+def create_message(apps, schema_editor):
+    Message = apps.get_model('main', 'Message')
+    MessageLanguage = apps.get_model('main', 'MessageLanguage')
+    MessageValue = apps.get_model('main', 'MessageValue')
+
+    language = MessageLanguage.objects.filter(default=True).first()
+    message, created = Message.objects.get_or_create(name='inline_item')
+    if created and language is not None:
+        MessageValue.objects.create(message=message, language=language, text=TEXT)
+
+
+def delete_message(apps, schema_editor):
+    apps.get_model('main', 'Message').objects.filter(name='inline_item').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0050_search_messages'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_message, delete_message),
+    ]
@@ -0,0 +1,27 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+import main.postgres
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0051_inline_item_message'),
+    ]
+
+    # The extension and the indexes are only created on PostgreSQL
+    operations = [
+        TrigramExtension(),
+        main.postgres.AddPostgresIndex(
+            model_name='telegramuser',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['username'], name='telegramuser_username_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+        main.postgres.AddPostgresIndex(
+            model_name='telegramuser',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['full_name'], name='telegramuser_full_name_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.0.6 on 2026-10-18 18:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    DailyJoinCount = apps.get_model('main', 'DailyJoinCount')
+
+    duplicates = DailyJoinCount.objects.order_by().values('date', 'referrer_id', 'language_id').annotate(
+        rows=Count('pk'), first=Min('pk'), total=Sum('count')).filter(rows__gt=1)
+    for row in duplicates:
+        rows = DailyJoinCount.objects.filter(date=row['date'], referrer_id=row['referrer_id'],
+                                             language_id=row['language_id'])
+        rows.exclude(pk=row['first']).delete()
+        rows.update(count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0052_telegramuser_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyjoincount',
+            constraint=models.UniqueConstraint(condition=models.Q(referrer=None), fields=('date', 'language'), name='unique_daily_join_without_referrer'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyjoincount',
+            constraint=models.UniqueConstraint(condition=models.Q(language=None), fields=('date', 'referrer'), name='unique_daily_join_without_language'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyjoincount',
+            constraint=models.UniqueConstraint(condition=models.Q(('language', None), ('referrer', None)), fields=('date',), name='unique_daily_join_without_referrer_and_language'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.6 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0053_dailyjoincount_null_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Название')),
+                ('holder', models.CharField(max_length=255, verbose_name='Владелец')),
+                ('expires', models.DateTimeField(verbose_name='Истекает')),
+            ],
+            options={
+                'verbose_name': 'Блокировка',
+                'verbose_name_plural': 'Блокировки',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+import main.postgres
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0054_lease'),
+    ]
+
+    # pg_trgm is created by 0052, the index only on PostgreSQL
+    operations = [
+        main.postgres.AddPostgresIndex(
+            model_name='entry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['description'], name='entry_description_trgm',
+                                                           opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -4,7 +4,8 @@ import os
 from functools import partial
 
 from PIL import Image
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.db import models, transaction
 
 import logging
 
@@ -99,12 +100,15 @@ class Category(MenuButton):
     parent = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='subcategories',
                                verbose_name='Основная категория', blank=True, null=True)
 
+    # Maintained by main.counters, rebuilt with `manage.py recount_items`
+    direct_items = models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров в категории')
+    total_items = models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров с подкатегориями')
+
     def count_items(self):
-        return self.items.count() if not self.is_super() else sum(
-            [category.count_items() for category in self.subcategories.all()]
-        )
+        return self.total_items
 
     count_items.short_description = "Количество товаров"
+    count_items.admin_order_field = 'total_items'
 
     class Meta:
         verbose_name = 'Категория'
@@ -189,6 +193,12 @@ class Entry(models.Model):
 
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='entries', verbose_name='Товар')
 
+    class Meta:
+        # Admin item search, created on PostgreSQL only
+        indexes = [
+            GinIndex(fields=['description'], name='entry_description_trgm', opclasses=['gin_trgm_ops']),
+        ]
+
     def __str__(self):
         return self.description
 
@@ -202,13 +212,8 @@ class Message(models.Model):
 
     @staticmethod
     def get(name, language):
-        if language is None:
-            language = MessageLanguage.objects.get(default=True)
-        try:
-            return Message.objects.get(name=name).values.get(language=language).text
-        except MessageValue.DoesNotExist:
-            language = MessageLanguage.objects.get(default=True)
-            return Message.objects.get(name=name).values.get(language=language).text
+        from main.translations import catalog
+        return catalog.get().get(name, language)
 
     def __str__(self):
         return self.name
@@ -241,6 +246,7 @@ class TelegramUser(models.Model):
     is_admin = models.BooleanField(default=False, verbose_name='Администратор')
     is_manager = models.BooleanField(default=False, verbose_name='Менеджер')
     joined = models.DateTimeField(auto_now_add=True, verbose_name='Зарегистрирован')
+    last_seen = models.DateTimeField(null=True, blank=True, verbose_name='Последняя активность')
 
     language = models.ForeignKey(MessageLanguage, on_delete=models.CASCADE,
                                  related_name='users', verbose_name='Язык',
@@ -253,10 +259,180 @@ class TelegramUser(models.Model):
     class Meta:
         verbose_name = 'Пользователь Telegram'
         verbose_name_plural = 'Пользователи Telegram'
+        # Admin substring search, created on PostgreSQL only
+        indexes = [
+            GinIndex(fields=['username'], name='telegramuser_username_trgm', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['full_name'], name='telegramuser_full_name_trgm', opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return self.full_name
 
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        # The join is counted under the reloaded values now, see main.signals.count_join
+        referrer_id, language_id = self._counted_join
+        if fields is None or {'referrer', 'referrer_id'} & set(fields):
+            referrer_id = self.referrer_id
+        if fields is None or {'language', 'language_id'} & set(fields):
+            language_id = self.language_id
+        self._counted_join = (referrer_id, language_id)
+
+
+# Users joined per day, referrer and language.
+# Maintained by main.stats, rebuilt with `manage.py rebuild_join_counts`
+class DailyJoinCount(models.Model):
+    date = models.DateField(verbose_name='Дата')
+    referrer = models.ForeignKey(TelegramUser, on_delete=models.CASCADE, related_name='daily_joins',
+                                 verbose_name='Реферер', null=True, blank=True)
+    language = models.ForeignKey(MessageLanguage, on_delete=models.CASCADE, related_name='daily_joins',
+                                 verbose_name='Язык', null=True, blank=True)
+    count = models.IntegerField(default=0, verbose_name='Количество')
+
+    class Meta:
+        verbose_name = 'Регистрации за день'
+        verbose_name_plural = 'Регистрации по дням'
+        unique_together = ('date', 'referrer', 'language')
+        # NULLs never conflict in unique_together, every NULL combination needs its own constraint
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'language'], condition=models.Q(referrer=None),
+                                    name='unique_daily_join_without_referrer'),
+            models.UniqueConstraint(fields=['date', 'referrer'], condition=models.Q(language=None),
+                                    name='unique_daily_join_without_language'),
+            models.UniqueConstraint(fields=['date'], condition=models.Q(referrer=None, language=None),
+                                    name='unique_daily_join_without_referrer_and_language'),
+        ]
+
+
+class Broadcast(models.Model):
+    DRAFT = 'draft'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    DONE = 'done'
+
+    STATUS_CHOICES = [
+        (DRAFT, 'Черновик'),
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Отправляется'),
+        (PAUSED, 'Приостановлена'),
+        (DONE, 'Завершена'),
+    ]
+
+    ALL = 'all'
+    MANAGERS = 'managers'
+    ADMINS = 'admins'
+
+    AUDIENCE_CHOICES = [
+        (ALL, 'Все пользователи'),
+        (MANAGERS, 'Менеджеры'),
+        (ADMINS, 'Администраторы'),
+    ]
+
+    message = models.ForeignKey(Message, on_delete=models.PROTECT, related_name='broadcasts',
+                                verbose_name='Сообщение')
+    audience = models.CharField(max_length=16, choices=AUDIENCE_CHOICES, default=ALL, verbose_name='Получатели')
+    language = models.ForeignKey(MessageLanguage, on_delete=models.SET_NULL, related_name='broadcasts',
+                                 verbose_name='Только на языке', null=True, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=DRAFT, db_index=True,
+                              verbose_name='Статус')
+
+    total = models.PositiveIntegerField(default=0, editable=False, verbose_name='Получателей')
+    sent = models.PositiveIntegerField(default=0, editable=False, verbose_name='Отправлено')
+    failed = models.PositiveIntegerField(default=0, editable=False, verbose_name='Ошибок')
+
+    created = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+    finished = models.DateTimeField(null=True, blank=True, editable=False, verbose_name='Завершена')
+
+    class Meta:
+        verbose_name = 'Рассылка'
+        verbose_name_plural = 'Рассылки'
+
+    def __str__(self):
+        return f"{self.message} ({self.get_status_display()})"
+
+    def get_users(self):
+        users = TelegramUser.objects.all()
+        if self.audience == self.MANAGERS:
+            users = users.filter(is_manager=True)
+        elif self.audience == self.ADMINS:
+            users = users.filter(is_admin=True)
+        if self.language_id is not None:
+            users = users.filter(language_id=self.language_id)
+        return users
+
+
+class BroadcastRecipient(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает'),
+        (SENDING, 'Отправляется'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    broadcast = models.ForeignKey(Broadcast, on_delete=models.CASCADE, related_name='recipients',
+                                  verbose_name='Рассылка')
+    user = models.ForeignKey(TelegramUser, on_delete=models.CASCADE, related_name='broadcasts',
+                             verbose_name='Пользователь')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, verbose_name='Статус')
+    error = models.CharField(max_length=255, blank=True, default="", verbose_name='Ошибка')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Получатель'
+        verbose_name_plural = 'Получатели'
+        unique_together = ('broadcast', 'user')
+        index_together = ('broadcast', 'status')
+
+
+# Work that only one process may do at a time, see main.broadcasts.hold_lease
+class Lease(models.Model):
+    name = models.CharField(max_length=64, unique=True, verbose_name='Название')
+    holder = models.CharField(max_length=255, verbose_name='Владелец')
+    expires = models.DateTimeField(verbose_name='Истекает')
+
+    class Meta:
+        verbose_name = 'Блокировка'
+        verbose_name_plural = 'Блокировки'
+
+
+# State of telegram conversations and user_data, stored by main.persistence
+class ConversationState(models.Model):
+    name = models.CharField(max_length=64, verbose_name='Диалог')
+    key = models.CharField(max_length=64, verbose_name='Ключ')
+    state = models.TextField(verbose_name='Состояние')
+    updated = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Состояние диалога'
+        verbose_name_plural = 'Состояния диалогов'
+        unique_together = ('name', 'key')
+
+
+class UserData(models.Model):
+    user_id = models.BigIntegerField(unique=True, verbose_name='ID пользователя')
+    data = models.TextField(default="{}", verbose_name='Данные')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Данные пользователя'
+        verbose_name_plural = 'Данные пользователей'
+
+
+# Webhook updates that were already dispatched, see main.dedup
+class ProcessedUpdate(models.Model):
+    update_id = models.BigIntegerField(unique=True, verbose_name='ID обновления')
+    received = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Получено')
+
+    class Meta:
+        verbose_name = 'Обработанное обновление'
+        verbose_name_plural = 'Обработанные обновления'
+
 
 def unique_filename(folder, instance, filename):
     _, ext = os.path.splitext(filename)
@@ -271,10 +447,61 @@ class Cover(models.Model):
     file = models.ImageField(upload_to=partial(unique_filename, 'covers'), verbose_name='Обложка', max_length=255)
     compress = models.BooleanField(default=True, verbose_name='Сжатие')
 
+    # file_id of the photo once Telegram received it, lets us resend it without uploading again
+    telegram_file_id = models.CharField(max_length=255, blank=True, default="", editable=False,
+                                        verbose_name='Telegram file_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_file = (instance.__dict__.get('file'), instance.__dict__.get('compress'))
+        return instance
+
     def save(self, *args, **kwargs):
+        changed = getattr(self, '_loaded_file', None) != (self.file.name, self.compress)
+        if changed:
+            self.telegram_file_id = ""
         super().save(*args, **kwargs)
-        if self.file:
-            with Image.open(self.file) as img:
-                if self.compress:
-                    img.thumbnail((640, 640), Image.ANTIALIAS)
-                img.save(self.file.path)
+        self._loaded_file = (self.file.name, self.compress)
+        if changed and self.file:
+            # The bot sends the file itself until its renditions are stored, keep it within Telegram's limits
+            if self.compress:
+                with Image.open(self.file.path) as img:
+                    img.thumbnail((640, 640), Image.LANCZOS)
+                    img.save(self.file.path)
+            from main.images import pipeline
+            transaction.on_commit(partial(pipeline.submit, self, force=True))
+
+    def get_rendition(self, kind):
+        # Iterates over .all() so that prefetch_related('renditions') is used
+        for rendition in self.renditions.all():
+            if rendition.kind == kind:
+                return rendition
+        return None
+
+
+class CoverRendition(models.Model):
+    TELEGRAM = 'telegram'
+    THUMBNAIL = 'thumbnail'
+    WEBP = 'webp'
+
+    KIND_CHOICES = [
+        (TELEGRAM, 'Для Telegram'),
+        (THUMBNAIL, 'Миниатюра'),
+        (WEBP, 'WebP'),
+    ]
+
+    cover = models.ForeignKey(Cover, on_delete=models.CASCADE, related_name='renditions', verbose_name='Обложка')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, verbose_name='Тип')
+    file = models.ImageField(max_length=255, verbose_name='Файл')
+    source = models.CharField(max_length=255, verbose_name='Исходный файл',
+                              help_text='Файл обложки, из которого получена копия')
+    width = models.PositiveIntegerField(verbose_name='Ширина')
+    height = models.PositiveIntegerField(verbose_name='Высота')
+    size = models.PositiveIntegerField(verbose_name='Размер, байт')
+    telegram_file_id = models.CharField(max_length=255, blank=True, default="", verbose_name='Telegram file_id')
+
+    class Meta:
+        verbose_name = 'Копия обложки'
+        verbose_name_plural = 'Копии обложки'
+        unique_together = ('cover', 'kind')
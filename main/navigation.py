@@ -0,0 +1,166 @@
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from itertools import chain, count
+from typing import Dict, Optional, Tuple
+
+from main.cache import Snapshot
+from main.models import Category, CategoryName, InfoButton, InfoButtonName, Item, Message, MessageLanguage
+
+_versions = count(1)
+
+
+@dataclass(frozen=True)
+class MenuNode:
+    id: int
+    priority: int
+    callback_data: str
+    # language id -> name, the None key holds the name in the default language
+    names: Dict[Optional[int], str] = field(repr=False)
+
+    @property
+    def pk(self):
+        return self.id
+
+    def get_name(self, language):
+        key = language.pk if language is not None else None
+        return self.names[key] if key in self.names else self.names.get(None, '')
+
+    def __str__(self):
+        return ', '.join(name for key, name in self.names.items() if key is not None)
+
+
+@dataclass(frozen=True)
+class InfoNode(MenuNode):
+    pass
+
+
+@dataclass(frozen=True)
+class CategoryNode(MenuNode):
+    parent_id: Optional[int] = None
+    has_models: bool = False
+    total_items: int = 0
+    children: Tuple[int, ...] = ()
+    # Ordered by pk, the order of next/prev
+    item_ids: Tuple[int, ...] = ()
+    item_positions: Dict[int, int] = field(default_factory=dict, repr=False)
+
+    def is_super(self):
+        return bool(self.children)
+
+    def get_position(self, item_id):
+        return self.item_positions.get(item_id)
+
+    def get_item_label(self, item_id, language):
+        """Names an item by its number in the category, as the list of models does."""
+        return f'{Message.get("model", language)} {self.get_position(item_id) + 1}'
+
+    def get_neighbour(self, item_id, step):
+        """
+        Returns the id of the item ``step`` positions away, wrapping around the ends.
+        """
+        if not self.item_ids:
+            return None
+        position = self.get_position(item_id)
+        if position is None:
+            # The item is gone, continue from where it used to be
+            position = bisect_left(self.item_ids, item_id) - (1 if step > 0 else 0)
+        return self.item_ids[(position + step) % len(self.item_ids)]
+
+    def get_page(self, cursor, size):
+        """
+        Returns ``(start, item ids, previous page cursor, next page cursor)`` for the page
+        starting at item ``cursor`` (the first page if the cursor is unknown).
+        """
+        start = self.get_position(cursor) or 0
+        previous = self.item_ids[max(start - size, 0)] if start > 0 else None
+        following = self.item_ids[start + size] if start + size < len(self.item_ids) else None
+        return start, self.item_ids[start:start + size], previous, following
+
+
+class NavigationTree:
+    """
+    Immutable snapshot of the menu: categories, info buttons, their names and callback data.
+
+    ``version`` identifies the content, a tree built with the same content as the ``previous``
+    one keeps its version, so periodic rebuilds don't expire what was rendered from it.
+    """
+
+    def __init__(self, categories, infos, previous=None):
+        if previous is not None and previous.categories == categories and previous.infos == infos:
+            self.version = previous.version
+        else:
+            self.version = next(_versions)
+        self.categories = categories
+        self.infos = infos
+        self.item_categories = {item_id: category for category in categories.values()
+                                for item_id in category.item_ids}
+
+        roots = sorted((category for category in categories.values() if category.parent_id is None),
+                       key=lambda node: node.id)
+        # By priority; on ties categories go before info buttons, each by id
+        self.menu = tuple(sorted(chain(roots, sorted(infos.values(), key=lambda node: node.id)),
+                                 key=lambda node: node.priority, reverse=True))
+
+    def get_category(self, pk):
+        return self.categories.get(int(pk))
+
+    def get_item_category(self, item_id):
+        return self.item_categories.get(item_id)
+
+    def get_parent(self, category):
+        return self.categories.get(category.parent_id) if category.parent_id is not None else None
+
+    def get_children(self, category):
+        return [self.categories[pk] for pk in category.children]
+
+
+def _names(rows, default_language_id):
+    names = {}
+    for button_id, language_id, name in rows:
+        names.setdefault(button_id, {})[language_id] = name
+    for button_names in names.values():
+        if default_language_id in button_names:
+            button_names[None] = button_names[default_language_id]
+    return names
+
+
+def load_navigation():
+    default_language_id = MessageLanguage.objects.filter(default=True).values_list('pk', flat=True).first()
+    category_names = _names(CategoryName.objects.values_list('button_id', 'language_id', 'name'), default_language_id)
+    info_names = _names(InfoButtonName.objects.values_list('button_id', 'language_id', 'name'), default_language_id)
+
+    items = {}
+    for pk, category_id in Item.objects.order_by('pk').values_list('pk', 'category_id'):
+        items.setdefault(category_id, []).append(pk)
+
+    rows = list(Category.objects.order_by('-priority', 'pk').values_list(
+        'pk', 'priority', 'parent_id', 'has_models', 'total_items'))
+    children = {}
+    for pk, priority, parent_id, has_models, total_items in rows:
+        if parent_id is not None:
+            children.setdefault(parent_id, []).append(pk)
+
+    categories = {}
+    for pk, priority, parent_id, has_models, total_items in rows:
+        if pk in children:
+            callback_data = f"submenu,{pk}"
+        elif has_models:
+            callback_data = f"items,{pk},list"
+        else:
+            callback_data = f"items,{pk},begin"
+        categories[pk] = CategoryNode(
+            id=pk, priority=priority, callback_data=callback_data, names=category_names.get(pk, {}),
+            parent_id=parent_id, has_models=has_models, total_items=total_items,
+            children=tuple(children.get(pk, ())), item_ids=tuple(items.get(pk, ())),
+            item_positions={item_id: position for position, item_id in enumerate(items.get(pk, ()))}
+        )
+
+    infos = {
+        pk: InfoNode(id=pk, priority=priority, callback_data=f"info,{pk}", names=info_names.get(pk, {}))
+        for pk, priority in InfoButton.objects.order_by('pk').values_list('pk', 'priority')
+    }
+
+    return NavigationTree(categories, infos, navigation.peek())
+
+
+navigation = Snapshot(load_navigation)
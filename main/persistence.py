@@ -0,0 +1,224 @@
+import datetime as dt
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+from collections.abc import MutableMapping
+
+from django.conf import settings
+from django.utils import timezone
+from telegram.ext import BasePersistence
+
+from main.models import ConversationState, UserData
+
+MISSING = object()
+
+
+def dump_key(key):
+    return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+
+class LazyConversations(MutableMapping):
+    """
+    Conversation states of one ConversationHandler, loaded from the database per key on
+    first access. Keys that weren't used for ``ttl`` seconds are dropped from memory and
+    read again when needed, so memory holds only the active chats.
+    """
+
+    def __init__(self, name, ttl=None):
+        self.name = name
+        self._ttl = settings.CACHE_TTL if ttl is None else ttl
+        self._states = OrderedDict()
+        self._changed = set()
+
+    def _touch(self, key, state):
+        now = time.monotonic()
+        self._states[key] = (state, now)
+        self._states.move_to_end(key)
+        while self._states:
+            oldest, (_, touched) = next(iter(self._states.items()))
+            if now - touched <= self._ttl:
+                break
+            del self._states[oldest]
+
+    def _load(self, key):
+        entry = self._states.get(key)
+        if entry is not None and time.monotonic() - entry[1] <= self._ttl:
+            state = entry[0]
+        else:
+            row = ConversationState.objects.filter(name=self.name, key=dump_key(key)) \
+                .values_list('state', flat=True).first()
+            state = MISSING if row is None else json.loads(row)
+        self._touch(key, state)
+        return state
+
+    def _set(self, key, state):
+        if self._load(key) != state:
+            self._changed.add(key)
+        self._touch(key, state)
+
+    def pop_changed(self, key):
+        """Tells whether the state of ``key`` changed since the previous call."""
+        changed = key in self._changed
+        self._changed.discard(key)
+        return changed
+
+    def __getitem__(self, key):
+        state = self._load(key)
+        if state is MISSING:
+            raise KeyError(key)
+        return state
+
+    def __setitem__(self, key, state):
+        self._set(key, state)
+
+    def __delitem__(self, key):
+        if self._load(key) is MISSING:
+            raise KeyError(key)
+        self._set(key, MISSING)
+
+    def __iter__(self):
+        return iter([key for key, (state, _) in self._states.items() if state is not MISSING])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class UserDataDict(dict):
+    """The data of one user, with the JSON it was last saved as."""
+
+    __slots__ = ('saved', '__weakref__')
+
+    def __init__(self, data, saved):
+        super().__init__(data)
+        self.saved = saved
+
+
+class LazyUserData(defaultdict):
+    """
+    ``user_data`` that reads the entry of a user from the database on first access.
+    Data is stored as JSON, so keys come back as strings.
+
+    Saved entries of users that weren't seen for ``ttl`` seconds, or beyond the ``size`` most
+    recently seen, are dropped from memory and read again when needed. An update that is still
+    holding a dropped entry gets the same object back, so none of its changes are lost.
+    """
+
+    def __init__(self, size=None, ttl=None):
+        super().__init__(dict)
+        self._size = settings.USER_CACHE_SIZE if size is None else size
+        self._ttl = settings.CACHE_TTL if ttl is None else ttl
+        self._lock = threading.RLock()
+        self._touched = OrderedDict()
+        self._dropped = weakref.WeakValueDictionary()
+
+    def __getitem__(self, user_id):
+        with self._lock:
+            value = super().__getitem__(user_id)
+            self._touch(user_id)
+            return value
+
+    def __missing__(self, user_id):
+        value = self._dropped.pop(user_id, None)
+        if value is None:
+            data = UserData.objects.filter(user_id=user_id).values_list('data', flat=True).first() or "{}"
+            value = UserDataDict(json.loads(data), data)
+        self[user_id] = value
+        return value
+
+    def __iter__(self):
+        # Reading entries drops others, iterate over a copy of the keys
+        with self._lock:
+            return iter(list(super().__iter__()))
+
+    def _touch(self, user_id):
+        now = time.monotonic()
+        for _ in range(len(self._touched)):
+            oldest, touched = next(iter(self._touched.items()))
+            if len(self._touched) < self._size and now - touched <= self._ttl:
+                break
+            value = self.get(oldest)
+            if oldest != user_id and (value is None or value.saved == json.dumps(value, sort_keys=True)):
+                del self._touched[oldest]
+                if value is not None:
+                    del self[oldest]
+                    self._dropped[oldest] = value
+            else:
+                # Not saved yet, an update is still changing it
+                self._touched[oldest] = now
+                self._touched.move_to_end(oldest)
+        self._touched[user_id] = now
+        self._touched.move_to_end(user_id)
+
+
+class DatabasePersistence(BasePersistence):
+    """
+    Keeps conversation states and user_data in the database.
+
+    Nothing is read at startup. Writes happen right after an update, and only for the
+    conversation keys and users whose data actually changed. Finished conversations are
+    deleted. Abandoned ones are removed by ``manage.py prune_conversations``.
+    """
+
+    def __init__(self):
+        super().__init__(store_user_data=True, store_chat_data=False)
+        self._conversations = {}
+        self._user_data = LazyUserData()
+        self._lock = threading.Lock()
+
+    def get_user_data(self):
+        return self._user_data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_conversations(self, name):
+        return self._conversations.setdefault(name, LazyConversations(name))
+
+    def update_conversation(self, name, key, new_state):
+        if not self._conversations[name].pop_changed(key):
+            return
+        states = ConversationState.objects.filter(name=name, key=dump_key(key))
+        if new_state is None:
+            states.delete()
+        elif not states.update(state=json.dumps(new_state), updated=timezone.now()):
+            ConversationState.objects.create(name=name, key=dump_key(key), state=json.dumps(new_state))
+
+    def update_user_data(self, user_id, data):
+        dumped = json.dumps(data, sort_keys=True)
+        with self._lock:
+            if data.saved == dumped:
+                return
+            data.saved = dumped
+        UserData.objects.update_or_create(user_id=user_id, defaults={'data': dumped})
+
+    def update_chat_data(self, chat_id, data):
+        pass
+
+
+def import_states(conversations, user_data):
+    """
+    Copies conversation states ({name: {key: state}}) and user_data ({user_id: data}) kept by
+    another persistence into the database, rows that exist already are kept.
+    Returns the numbers of conversation states and user_data entries copied.
+    """
+    states = [ConversationState(name=name, key=dump_key(key), state=json.dumps(state))
+              for name, keys in conversations.items() for key, state in keys.items() if state is not None]
+    users = [UserData(user_id=user_id, data=json.dumps(data, sort_keys=True))
+             for user_id, data in user_data.items() if data]
+    existing_states = set(ConversationState.objects.values_list('name', 'key'))
+    existing_users = set(UserData.objects.values_list('user_id', flat=True))
+    states = [state for state in states if (state.name, state.key) not in existing_states]
+    users = [data for data in users if data.user_id not in existing_users]
+    ConversationState.objects.bulk_create(states, batch_size=1000)
+    UserData.objects.bulk_create(users, batch_size=1000)
+    return len(states), len(users)
+
+
+def prune_conversations(days=None):
+    """Deletes conversations that weren't updated for ``days``, returns their number."""
+    days = settings.CONVERSATION_TTL_DAYS if days is None else days
+    deleted, _ = ConversationState.objects.filter(updated__lt=timezone.now() - dt.timedelta(days=days)) \
+        .delete()
+    return deleted
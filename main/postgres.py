@@ -0,0 +1,36 @@
+from django.db.migrations import AddIndex
+from django.db.models import CharField, TextField
+from django.db.models.lookups import IContains
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class TrigramContains(IContains):
+    """
+    ``icontains`` that a pg_trgm GIN index of the column can serve on PostgreSQL.
+
+    Django's own ``icontains`` compares UPPER(column), which no index of the column serves;
+    this lookup runs ILIKE on the column itself. Other databases get the usual ``icontains``.
+    """
+
+    lookup_name = 'trigram_contains'
+
+    def as_sql(self, compiler, connection):
+        return IContains(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+
+class AddPostgresIndex(AddIndex):
+    """``AddIndex`` for PostgreSQL-only indexes like GinIndex, other databases skip it."""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
@@ -0,0 +1,28 @@
+import logging
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+from django.template import Template, Context, TemplateSyntaxError
+
+from main.models import MessageValue
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=settings.TEMPLATE_CACHE_SIZE)
+def compile_template(template: str) -> Template:
+    return Template(template)
+
+
+def render(template: str, context: Optional[dict] = None):
+    return compile_template(template).render(Context(context))
+
+
+def warm_up_templates():
+    for text in MessageValue.objects.values_list('text', flat=True).distinct().iterator():
+        try:
+            compile_template(text)
+        except TemplateSyntaxError as e:
+            logger.warning('Could not compile message template: %s', e)
+    logger.info('Templates compiled: %s', compile_template.cache_info())
@@ -0,0 +1,35 @@
+import os
+
+from PIL import Image, ImageOps
+
+# Kept free of Django imports: this module is loaded by the image worker processes.
+
+# kind: (format, extension, max size when compressed, max size otherwise, save options)
+RENDITIONS = {
+    'telegram': ('JPEG', 'jpg', (640, 640), (2560, 2560), {'quality': 85, 'optimize': True}),
+    'thumbnail': ('JPEG', 'jpg', (320, 320), (320, 320), {'quality': 80, 'optimize': True}),
+    'webp': ('WEBP', 'webp', (1280, 1280), (1280, 1280), {'quality': 80, 'method': 4}),
+}
+
+
+def render_renditions(source_path, compress, targets):
+    """
+    Writes renditions of an image to ``targets`` ({kind: path}),
+    returns {kind: (width, height, size in bytes)}.
+    """
+    results = {}
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    for kind, path in targets.items():
+        image_format, _, compressed_size, full_size, options = RENDITIONS[kind]
+        rendition = image.copy()
+        rendition.thumbnail(compressed_size if compress else full_size, Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A half written file is never served under the final name
+        temporary_path = f"{path}.tmp"
+        rendition.save(temporary_path, image_format, **options)
+        os.replace(temporary_path, path)
+        results[kind] = (rendition.width, rendition.height, os.path.getsize(path))
+    return results
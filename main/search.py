@@ -0,0 +1,218 @@
+import heapq
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict, Counter, OrderedDict
+from typing import List
+
+from django.conf import settings
+
+from main.cache import Snapshot
+from main.models import Entry
+
+WORD = re.compile(r'\w+')
+
+# Weight of a word in the title compared to the same word in the description
+TITLE_WEIGHT = 3
+PREFIX_FACTOR = 0.7
+FUZZY_FACTOR = 0.5
+MIN_SIMILARITY = 0.35
+MAX_EXPANSIONS = 50
+RESULTS_CACHE_SIZE = 256
+# Share of a language's items above which a word is ignored if the query has other words
+STOP_WORD_SHARE = 0.5
+
+
+def tokenize(text):
+    return WORD.findall(text.lower().replace('ё', 'е'))
+
+
+def trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Inverted index of entry titles and descriptions, one per language.
+
+    A query word matches indexed words exactly, by prefix or, when neither finds anything,
+    by trigram similarity, so typos and word endings still find the item. Items are ranked by
+    the number of query words they match, then by weight: title words count more than
+    description words and exact matches more than prefixes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._items = defaultdict(set)
+        self._item_counts = defaultdict(int)
+        # language -> word -> item -> weight of the word in the item's best entry
+        self._postings = defaultdict(lambda: defaultdict(dict))
+        # language -> word -> items with the word in a title
+        self._titles = defaultdict(lambda: defaultdict(set))
+        self._vocabulary = defaultdict(list)
+        self._trigrams = defaultdict(lambda: defaultdict(set))
+        # Ranked item ids of recent queries, paging through results doesn't rank them again
+        self._results = OrderedDict()
+
+    def add(self, entry_id, item_id, language_id, title, description):
+        weights = defaultdict(int)
+        title_tokens = set(tokenize(title))
+        for token in tokenize(title):
+            weights[token] += TITLE_WEIGHT
+        for token in tokenize(description):
+            weights[token] += 1
+
+        with self._lock:
+            tokens = self._remove(entry_id)
+            self._entries[entry_id] = (item_id, language_id, title, dict(weights), title_tokens)
+            if (language_id, item_id) not in self._items:
+                self._item_counts[language_id] += 1
+            self._items[language_id, item_id].add(entry_id)
+            self._update_item(language_id, item_id, tokens | weights.keys())
+
+    def remove(self, entry_id):
+        with self._lock:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        self._results.clear()
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return set()
+        item_id, language_id, _, weights, _ = entry
+        entries = self._items[language_id, item_id]
+        entries.discard(entry_id)
+        if not entries:
+            del self._items[language_id, item_id]
+            self._item_counts[language_id] -= 1
+        self._update_item(language_id, item_id, weights.keys())
+        return set(weights)
+
+    def _update_item(self, language_id, item_id, tokens):
+        """Recomputes the item's postings of ``tokens`` from its entries."""
+        entries = [self._entries[entry_id] for entry_id in self._items.get((language_id, item_id), ())]
+        postings = self._postings[language_id]
+        titles = self._titles[language_id]
+        for token in tokens:
+            weight = max((entry[3].get(token, 0) for entry in entries), default=0)
+            if any(token in entry[4] for entry in entries):
+                titles[token].add(item_id)
+            elif token in titles:
+                titles[token].discard(item_id)
+                if not titles[token]:
+                    del titles[token]
+            if weight:
+                if token not in postings:
+                    vocabulary = self._vocabulary[language_id]
+                    vocabulary.insert(bisect_left(vocabulary, token), token)
+                    for trigram in trigrams(token):
+                        self._trigrams[language_id][trigram].add(token)
+                postings[token][item_id] = weight
+            elif token in postings:
+                items = postings[token]
+                items.pop(item_id, None)
+                if not items:
+                    del postings[token]
+                    vocabulary = self._vocabulary[language_id]
+                    del vocabulary[bisect_left(vocabulary, token)]
+                    for trigram in trigrams(token):
+                        self._trigrams[language_id][trigram].discard(token)
+
+    def _expand(self, language_id, term):
+        """Indexed words matching ``term`` with their factors."""
+        postings = self._postings[language_id]
+        matches = {term: 1.0} if term in postings else {}
+
+        vocabulary = self._vocabulary[language_id]
+        i = bisect_left(vocabulary, term)
+        while i < len(vocabulary) and vocabulary[i].startswith(term) and len(matches) < MAX_EXPANSIONS:
+            matches.setdefault(vocabulary[i], PREFIX_FACTOR)
+            i += 1
+
+        if not matches and len(term) > 2:
+            query = trigrams(term)
+            shared = defaultdict(int)
+            for trigram in query:
+                for token in self._trigrams[language_id].get(trigram, ()):
+                    shared[token] += 1
+            similar = ((count / (len(query) + len(token) - count), token) for token, count in shared.items())
+            for similarity, token in heapq.nlargest(MAX_EXPANSIONS, similar):
+                if similarity < MIN_SIMILARITY:
+                    break
+                matches[token] = FUZZY_FACTOR * similarity
+        return matches
+
+    def _title(self, language_id, item_id):
+        return self._entries[min(self._items[language_id, item_id])][2]
+
+    def search(self, query, language_id, limit=None) -> List[tuple]:
+        """Returns ``(item_id, title)`` of the best matching items, best first."""
+        key = (language_id, tuple(dict.fromkeys(tokenize(query))))
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and (cached[1] or limit is not None and len(cached[0]) >= limit):
+                self._results.move_to_end(key)
+                ranked = cached[0][:limit]
+            else:
+                ranked = self._rank(language_id, key[1], limit)
+                self._results[key] = (ranked, limit is None or len(ranked) < limit)
+                while len(self._results) > RESULTS_CACHE_SIZE:
+                    self._results.popitem(last=False)
+            return [(item_id, self._title(language_id, item_id)) for item_id in ranked]
+
+    def _rank(self, language_id, words, limit):
+        postings = self._postings[language_id]
+        titles = self._titles[language_id]
+        terms = []
+        for term in words:
+            expansions = self._expand(language_id, term)
+            found = set().union(*(postings[token].keys() for token in expansions))
+            terms.append(([(postings[token], factor) for token, factor in expansions.items()], expansions, found))
+
+        # Words most items have, like conjunctions, only slow ranking down when there are others
+        frequent = STOP_WORD_SHARE * self._item_counts[language_id]
+        terms = [term for term in terms if len(term[2]) <= frequent] or terms
+
+        in_titles = [set().union(*(titles.get(token, ()) for token in expansions)) for _, expansions, _ in terms]
+        if len(terms) == 1:
+            found = terms[0][2]
+            levels = [in_titles[0] & found, found - in_titles[0]]
+        else:
+            # Counting runs in C, only the grouping by counts loops over the items
+            matched, titled = Counter(), Counter()
+            for (_, _, found), title_items in zip(terms, in_titles):
+                matched.update(found)
+                titled.update(title_items)
+            grouped = defaultdict(list)
+            for item_id, count in matched.items():
+                grouped[count, titled[item_id]].append(item_id)
+            levels = [grouped[level] for level in sorted(grouped, reverse=True)]
+
+        if len(terms) == 1 and len(terms[0][0]) == 1 and terms[0][0][0][1] == 1.0:
+            score = terms[0][0][0][0].get
+        else:
+            def score(item_id):
+                return sum(max(factor * items.get(item_id, 0) for items, factor in term) for term, _, _ in terms)
+
+        ranked = []
+        for level in levels:
+            if limit is None:
+                ranked.extend(sorted(level, key=score, reverse=True))
+            else:
+                ranked.extend(heapq.nlargest(limit - len(ranked), level, key=score))
+                if len(ranked) >= limit:
+                    break
+        return ranked
+
+
+def load_search_index():
+    index = SearchIndex()
+    for pk, item_id, language_id, title, description in Entry.objects.values_list(
+            'pk', 'item_id', 'language_id', 'description', 'long_description').iterator():
+        index.add(pk, item_id, language_id, title, description)
+    return index
+
+
+search_index = Snapshot(load_search_index, ttl=settings.SEARCH_INDEX_TTL)
@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from main.models import TelegramUser
+
+logger = logging.getLogger(__name__)
+
+
+class UserSessions:
+    """
+    Keeps resolved TelegramUser objects per chat, so that an update from a known user
+    costs no queries unless their Telegram profile changed.
+
+    ``last_seen`` is only stamped on the cached object and written to the database
+    in batches by ``flush()``, which the background flusher calls every ``flush_interval``.
+    """
+
+    def __init__(self, size=None, ttl=None, flush_interval=None):
+        self._size = settings.USER_CACHE_SIZE if size is None else size
+        self._ttl = settings.USER_CACHE_TTL if ttl is None else ttl
+        self._flush_interval = settings.LAST_SEEN_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._seen = set()
+        self._flusher = None
+
+    def _cached(self, chat_id):
+        with self._lock:
+            entry = self._users.get(chat_id)
+            if entry is None:
+                return None
+            user, loaded_at = entry
+            if self._ttl > 0 and time.monotonic() - loaded_at > self._ttl:
+                del self._users[chat_id]
+                return None
+            self._users.move_to_end(chat_id)
+            return user
+
+    def _remember(self, user):
+        with self._lock:
+            self._users[user.chat_id] = (user, time.monotonic())
+            self._users.move_to_end(user.chat_id)
+            while len(self._users) > self._size:
+                self._users.popitem(last=False)
+
+    def resolve(self, chat_id, full_name, username):
+        user, created = self._cached(chat_id), False
+        if user is None:
+            user, created = TelegramUser.objects.get_or_create(
+                chat_id=chat_id,
+                defaults={'full_name': full_name, 'username': username}
+            )
+            self._remember(user)
+
+        if user.full_name != full_name or user.username != username:
+            TelegramUser.objects.filter(pk=user.pk).update(full_name=full_name, username=username)
+            user.full_name, user.username = full_name, username
+
+        self.touch(user)
+        return user, created
+
+    def peek(self, chat_id):
+        """The cached user of a chat without resolving it, None if it isn't cached."""
+        return self._cached(chat_id)
+
+    def forget(self, user):
+        with self._lock:
+            entry = self._users.get(user.chat_id)
+            # Saves of the cached object itself keep it up to date
+            if entry is not None and entry[0] is not user:
+                del self._users[user.chat_id]
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def touch(self, user):
+        user.last_seen = timezone.now()
+        with self._lock:
+            self._seen.add(user.pk)
+
+    def flush(self):
+        with self._lock:
+            seen, self._seen = self._seen, set()
+        if not seen:
+            return
+
+        seen, last_seen = list(seen), timezone.now()
+        for i in range(0, len(seen), 500):
+            TelegramUser.objects.filter(pk__in=seen[i:i + 500]).update(last_seen=last_seen)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush last seen timestamps')
+
+    def start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_forever, name='last-seen-flusher', daemon=True)
+            self._flusher.start()
+
+
+sessions = UserSessions()
@@ -0,0 +1,181 @@
+import threading
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_init, pre_delete
+from django.db.models import DEFERRED
+from django.dispatch import receiver
+
+from main.models import Message, MessageValue, MessageLanguage, TelegramUser, Category, CategoryName, InfoButton, \
+    InfoButtonName, Item, Entry, Cover, CoverRendition
+from main.cards import cards
+from main.counters import add_items, move_category, recount_ancestors
+from main.inline import inline_catalog
+from main.navigation import navigation
+from main.search import search_index
+from main.sessions import sessions
+from main.stats import add_join
+from main.translations import catalog
+
+
+@receiver([post_save, post_delete], sender=Message)
+@receiver([post_save, post_delete], sender=MessageValue)
+@receiver([post_save, post_delete], sender=MessageLanguage)
+def invalidate_translations(sender, **kwargs):
+    transaction.on_commit(catalog.invalidate)
+
+
+@receiver([post_save, post_delete], sender=TelegramUser)
+def forget_user_session(sender, instance, **kwargs):
+    sessions.forget(instance)
+
+
+@receiver(post_init, sender=TelegramUser)
+def remember_join_key(sender, instance, **kwargs):
+    instance._counted_join = (instance.__dict__.get('referrer_id', DEFERRED),
+                              instance.__dict__.get('language_id', DEFERRED))
+
+
+@receiver(post_save, sender=TelegramUser)
+def count_join(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if update_fields is not None and not {'referrer', 'referrer_id', 'language', 'language_id'} & update_fields:
+        return
+    old_key, key = instance._counted_join, (instance.referrer_id, instance.language_id)
+    if raw or DEFERRED in old_key or instance.joined is None:
+        return
+    if created:
+        add_join(instance.joined, *key, 1)
+    elif old_key != key:
+        add_join(instance.joined, *old_key, -1)
+        add_join(instance.joined, *key, 1)
+    instance._counted_join = key
+
+
+@receiver(post_delete, sender=TelegramUser)
+def count_deleted_join(sender, instance, **kwargs):
+    if instance.joined is not None:
+        add_join(instance.joined, instance.referrer_id, instance.language_id, -1)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=CategoryName)
+@receiver([post_save, post_delete], sender=InfoButton)
+@receiver([post_save, post_delete], sender=InfoButtonName)
+@receiver([post_save, post_delete], sender=Item)
+@receiver([post_save, post_delete], sender=MessageLanguage)
+def refresh_navigation(sender, **kwargs):
+    transaction.on_commit(navigation.refresh)
+
+
+@receiver([post_save, post_delete], sender=Item)
+def invalidate_item_card(sender, instance, **kwargs):
+    transaction.on_commit(partial(cards.invalidate, instance.pk))
+
+
+@receiver([post_save, post_delete], sender=Entry)
+@receiver([post_save, post_delete], sender=Cover)
+def invalidate_item_cards(sender, instance, **kwargs):
+    if instance.item_id is not None:
+        transaction.on_commit(partial(cards.invalidate, instance.item_id))
+
+
+@receiver([post_save, post_delete], sender=Entry)
+@receiver([post_save, post_delete], sender=Cover)
+@receiver([post_save, post_delete], sender=CoverRendition)
+def refresh_inline_catalog(sender, **kwargs):
+    transaction.on_commit(inline_catalog.refresh)
+
+
+def index_entry(entry):
+    index = search_index.peek()
+    if index is not None:
+        index.add(entry.pk, entry.item_id, entry.language_id, entry.description, entry.long_description)
+
+
+def unindex_entry(entry_id):
+    index = search_index.peek()
+    if index is not None:
+        index.remove(entry_id)
+
+
+@receiver(post_save, sender=Entry)
+def index_saved_entry(sender, instance, **kwargs):
+    transaction.on_commit(partial(index_entry, instance))
+
+
+@receiver(post_delete, sender=Entry)
+def unindex_deleted_entry(sender, instance, **kwargs):
+    transaction.on_commit(partial(unindex_entry, instance.pk))
+
+
+@receiver(post_init, sender=Item)
+def remember_item_category(sender, instance, **kwargs):
+    # __dict__ avoids loading a deferred field
+    instance._counted_category_id = instance.__dict__.get('category_id')
+
+
+@receiver(post_save, sender=Item)
+def count_saved_item(sender, instance, created, raw=False, **kwargs):
+    old_category_id = instance._counted_category_id
+    if raw or (not created and old_category_id is None):
+        return
+    if created:
+        add_items(instance.category_id, 1)
+    elif old_category_id != instance.category_id:
+        add_items(old_category_id, -1)
+        add_items(instance.category_id, 1)
+    instance._counted_category_id = instance.category_id
+
+
+# Categories being deleted by this thread and the parents whose counters they leave behind
+_category_deletes = threading.local()
+
+
+def get_category_deletes():
+    if not hasattr(_category_deletes, 'deleting'):
+        _category_deletes.deleting, _category_deletes.deleted, _category_deletes.parents = set(), set(), set()
+    return _category_deletes
+
+
+def recount_after_category_deletes():
+    deletes = get_category_deletes()
+    parents, deletes.parents = deletes.parents - deletes.deleted, set()
+    deletes.deleted = set()
+    for parent_id in parents:
+        recount_ancestors(parent_id)
+
+
+@receiver(pre_delete, sender=Category)
+def start_category_delete(sender, instance, **kwargs):
+    # Items deleted along with the category are counted once, after commit
+    deletes = get_category_deletes()
+    deletes.deleting.add(instance.pk)
+    deletes.deleted.add(instance.pk)
+    if instance.parent_id is not None:
+        deletes.parents.add(instance.parent_id)
+    transaction.on_commit(recount_after_category_deletes)
+
+
+@receiver(post_delete, sender=Category)
+def finish_category_delete(sender, instance, **kwargs):
+    # Its items are deleted before the category itself
+    get_category_deletes().deleting.discard(instance.pk)
+
+
+@receiver(post_delete, sender=Item)
+def count_deleted_item(sender, instance, **kwargs):
+    if instance.category_id not in get_category_deletes().deleting:
+        add_items(instance.category_id, -1)
+
+
+@receiver(post_init, sender=Category)
+def remember_category_parent(sender, instance, **kwargs):
+    instance._counted_parent_id = instance.__dict__.get('parent_id', DEFERRED)
+
+
+@receiver(post_save, sender=Category)
+def count_moved_category(sender, instance, created, raw=False, **kwargs):
+    old_parent_id = instance._counted_parent_id
+    if not raw and not created and old_parent_id is not DEFERRED and old_parent_id != instance.parent_id:
+        move_category(instance.pk, old_parent_id, instance.parent_id)
+    instance._counted_parent_id = instance.parent_id
@@ -0,0 +1,109 @@
+import datetime as dt
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from main.models import DailyJoinCount, TelegramUser
+from main.translations import catalog
+
+PERIODS = {
+    'today': 0,
+    'week': 6,
+    'month': 29,
+}
+
+
+def add_join(joined, referrer_id, language_id, delta):
+    date = timezone.localdate(joined)
+    rows = DailyJoinCount.objects.filter(date=date, referrer_id=referrer_id, language_id=language_id)
+    # Nothing to subtract from when the row is gone, e.g. deleted together with the referrer
+    if rows.update(count=F('count') + delta) or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            DailyJoinCount.objects.create(date=date, referrer_id=referrer_id, language_id=language_id, count=delta)
+    except IntegrityError:
+        # Another worker created the row in the meantime
+        rows.update(count=F('count') + delta)
+
+
+def rebuild_join_counts():
+    rows = TelegramUser.objects.order_by().annotate(
+        date=TruncDate('joined', tzinfo=timezone.get_current_timezone())
+    ).values('date', 'referrer_id', 'language_id').annotate(count=Count('pk'))
+
+    with transaction.atomic():
+        DailyJoinCount.objects.all().delete()
+        DailyJoinCount.objects.bulk_create([DailyJoinCount(**row) for row in rows], batch_size=500)
+    return len(rows)
+
+
+def get_period_filters(field='date'):
+    today = timezone.localdate()
+    filters = {name: Q(**{f'{field}__gte': today - dt.timedelta(days=days)}) for name, days in PERIODS.items()}
+    filters['since_launch'] = Q(**{f'{field}__gte': timezone.localdate(settings.LAUNCH_DATE)})
+    return filters
+
+
+def get_join_counts(**filters):
+    """
+    Sums the daily counts for every period, grouped by referrer and language.
+    """
+    periods = get_period_filters()
+    return DailyJoinCount.objects.filter(**filters).order_by().values('referrer_id', 'language_id').annotate(
+        total=Sum('count'),
+        **{name: Sum('count', filter=condition) for name, condition in periods.items()}
+    )
+
+
+def sum_counts(rows):
+    result = dict.fromkeys(['total', *PERIODS, 'since_launch'], 0)
+    for row in rows:
+        for name in result:
+            result[name] += row[name] or 0
+    return result
+
+
+def compute_referral_stats():
+    rows = list(get_join_counts())
+    languages = catalog.get()
+
+    by_referrer, by_language = {}, {}
+    for row in rows:
+        by_referrer.setdefault(row['referrer_id'], []).append(row)
+        by_language.setdefault(row['language_id'], []).append(row)
+
+    data = []
+    for manager in TelegramUser.objects.filter(is_manager=True):
+        data.append({'profile': manager, **sum_counts(by_referrer.get(manager.pk, []))})
+    data.sort(key=lambda row: row['total'], reverse=True)
+
+    totals = sum_counts(rows)
+    return {
+        'days': (timezone.now() - settings.LAUNCH_DATE).days,
+        'total_users': totals['total'],
+        'new_users_today': totals['today'],
+        'new_users_week': totals['week'],
+        'new_users_month': totals['month'],
+        'new_users_since_launch': totals['since_launch'],
+        'languages': [
+            {'language': languages.get_language(language_id), **sum_counts(language_rows)}
+            for language_id, language_rows in by_language.items()
+        ],
+        'data': data
+    }
+
+
+def get_referral_stats():
+    if settings.STATS_CACHE_TTL <= 0:
+        return compute_referral_stats()
+    # Admins asking for /stats at the same time share one computation
+    return cache.get_or_set('main:referral_stats', compute_referral_stats, settings.STATS_CACHE_TTL)
+
+
+def get_personal_referral_stats(user):
+    return sum_counts(get_join_counts(referrer=user))
@@ -1,43 +1,52 @@
 import logging
+from functools import wraps
 from typing import Optional, List
 
 from django.conf import settings
 from django.db.models import Count
-from django.template import Template, Context
+from django.template import Context
 from django.utils import timezone
-from django.utils.timezone import now
 from django_telegrambot.apps import DjangoTelegramBot
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, ParseMode, \
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from telegram.ext import CommandHandler, CallbackContext, CallbackQueryHandler, ConversationHandler, MessageHandler, \
-    Filters
-from telegram.ext.dispatcher import run_async
-from itertools import chain
-import datetime as dt
-
-from main.models import Item, TelegramUser, Category, Message, InfoButton, MessageLanguage
+    Filters, TypeHandler, InlineQueryHandler
+
+from main.broadcasts import broadcaster
+from main.cards import cards, ItemCard
+from main.models import Item, TelegramUser, Message, InfoButton, Cover, CoverRendition
+from main.navigation import CategoryNode, navigation
+from main.rendering import render, warm_up_templates
+from main.context import get_request, bind_request
+from main.dedup import updates
+from main.executor import ChatExecutor
+from main.inline import inline_catalog
+from main.metrics import metrics, measure_dispatcher, measure_bot
+from main.persistence import DatabasePersistence
+from main.search import search_index
+from main.sessions import sessions
+from main.stats import get_referral_stats, get_personal_referral_stats
+from main.translations import catalog
 
 logger = logging.getLogger(__name__)
 
 LANGUAGE, FULL_NAME, PHONE = list(range(3))
 
+# Longer item titles are cut on search result buttons
+BUTTON_TITLE_LENGTH = 64
+
 
 def inject_user(func):
+    @wraps(func)
     def injection_func(update: Update, context: CallbackContext, *args, **kwargs):
-        kwargs['user'], context.user_data['created'] = TelegramUser.objects.update_or_create(
-            chat_id=update.effective_chat.id,
-            defaults={
-                'full_name': update.effective_user.full_name,
-                'username': update.effective_user.username
-                if update.effective_user.username is not None else ''
-            }
-        )
+        kwargs['user'] = get_request(update, context).user
         return func(update, context, *args, **kwargs)
 
     return injection_func
 
 
 def is_admin(func):
+    @wraps(func)
     @inject_user
     def authorized_request(update: Update, context: CallbackContext, user: TelegramUser, *args, **kwargs):
         if not user.is_admin:
@@ -50,6 +59,7 @@ def is_admin(func):
 
 
 def is_manager(func):
+    @wraps(func)
     @inject_user
     def authorized_request(update: Update, context: CallbackContext, user: TelegramUser, *args, **kwargs):
         if not user.is_manager and not user.is_admin:
@@ -63,19 +73,13 @@ def is_manager(func):
 
 class KeyboardEntryPoint:
     def __init__(self, message):
-        self.messsage = message
+        self.message = message
 
     def __contains__(self, item):
-        for lang in MessageLanguage.objects.all():
-            if item in Message.get(self.messsage, lang):
-                return True
-        return False
+        return any(item in text for text in catalog.get().get_translations(self.message))
 
     def __eq__(self, item):
-        for lang in MessageLanguage.objects.all():
-            if item == Message.get(self.messsage, lang):
-                return True
-        return False
+        return self.message in catalog.get().find_messages(item)
 
 
 @inject_user
@@ -87,14 +91,34 @@ def get_main_keyboard(update: Update, context: CallbackContext, user: TelegramUs
     ], resize_keyboard=True)
 
 
-def show_covers(update: Update, context: CallbackContext, covers):
+def get_photo(cover: Cover):
+    # Cover or its rendition prepared for Telegram, both have a file and a file_id
+    return cover.get_rendition(CoverRendition.TELEGRAM) or cover
+
+
+def get_cover_media(cover: Cover):
+    photo = get_photo(cover)
+    if photo.telegram_file_id:
+        return InputMediaPhoto(photo.telegram_file_id)
     if settings.DEBUG:
-        for chunk in chunks(covers, 10):
-            update.effective_message.reply_media_group([InputMediaPhoto(cover.file.file) for cover in chunk])
-    else:
-        for chunk in chunks(covers, 10):
-            update.effective_message.reply_media_group(
-                [InputMediaPhoto(settings.WEBSITE_LINK + cover.file.url) for cover in chunk])
+        return InputMediaPhoto(photo.file.file)
+    return InputMediaPhoto(settings.WEBSITE_LINK + photo.file.url)
+
+
+def remember_file_ids(covers, messages):
+    for cover, message in zip(covers, messages):
+        photo = get_photo(cover)
+        if not photo.telegram_file_id and message.photo:
+            photo.telegram_file_id = message.photo[-1].file_id
+            # Only if the file was not replaced in the meantime
+            type(photo).objects.filter(pk=photo.pk, file=photo.file.name).update(
+                telegram_file_id=photo.telegram_file_id)
+
+
+def show_covers(update: Update, context: CallbackContext, covers):
+    for chunk in chunks(list(covers.prefetch_related('renditions')), 10):
+        messages = update.effective_message.reply_media_group([get_cover_media(cover) for cover in chunk])
+        remember_file_ids(chunk, messages)
 
 
 def send_maps(update: Update, context: CallbackContext, maps):
@@ -108,8 +132,10 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 
-def render(template: str, context: Optional[dict] = None):
-    return Template(template).render(Context(context))
+def shorten(text, length):
+    '''Cut text to at most length characters, marking the cut with an ellipsis.'''
+    text = ' '.join(text.split())
+    return text if len(text) <= length else text[:length - 1].rstrip() + '…'
 
 
 @inject_user
@@ -133,10 +159,8 @@ def show_info(update: Update, context: CallbackContext, info: InfoButton, user:
 
 @inject_user
 def show_menu(update: Update, context: CallbackContext, user: TelegramUser):
-    buttons = [InlineKeyboardButton(obj.get_name(user.language), callback_data=obj.get_callback_data()) for obj in
-               sorted(chain(
-                   Category.objects.filter(parent=None), InfoButton.objects.all()
-               ), key=lambda x: x.priority, reverse=True)]
+    buttons = [InlineKeyboardButton(node.get_name(user.language), callback_data=node.callback_data)
+               for node in get_request(update, context).navigation.menu]
 
     keyboard = InlineKeyboardMarkup([chunk for chunk in chunks(buttons, 2)])
 
@@ -150,17 +174,21 @@ def show_menu(update: Update, context: CallbackContext, user: TelegramUser):
     return ConversationHandler.END
 
 
+def get_category_controls(update: Update, context: CallbackContext, category: CategoryNode, user: TelegramUser):
+    parent = get_request(update, context).navigation.get_parent(category)
+    if parent is not None:
+        return [InlineKeyboardButton(Message.get("back", user.language), callback_data=parent.callback_data)]
+    return [InlineKeyboardButton(Message.get("all_categories", user.language), callback_data='menu')]
+
+
 @inject_user
-def show_submenu(update: Update, context: CallbackContext, category: Category, user: TelegramUser):
-    controls = [InlineKeyboardButton(Message.get("all_categories", user.language), callback_data='menu')]
-    if category.parent is not None:
-        controls = [
-            InlineKeyboardButton(Message.get("back", user.language), callback_data=category.parent.get_callback_data())]
+def show_submenu(update: Update, context: CallbackContext, category: CategoryNode, user: TelegramUser):
+    controls = get_category_controls(update, context, category, user)
     keyboard = InlineKeyboardMarkup(
         [
-            [InlineKeyboardButton(category.get_name(user.language), callback_data=category.get_callback_data()) for
+            [InlineKeyboardButton(category.get_name(user.language), callback_data=category.callback_data) for
              category in chunk]
-            for chunk in chunks(category.subcategories.order_by('-priority'), 2)
+            for chunk in chunks(get_request(update, context).navigation.get_children(category), 2)
         ] + [controls])
     update.effective_message.reply_text(render(Message.get('submenu', user.language),
                                                {'category': category,
@@ -170,16 +198,25 @@ def show_submenu(update: Update, context: CallbackContext, category: Category, u
 
 
 @inject_user
-def show_category_list(update: Update, context: CallbackContext, category: Category, user: TelegramUser):
-    controls = [InlineKeyboardButton(Message.get("all_categories", user.language), callback_data='menu')]
-    if category.parent is not None:
-        controls = [
-            InlineKeyboardButton(Message.get("back", user.language), callback_data=category.parent.get_callback_data())]
+def show_category_list(update: Update, context: CallbackContext, category: CategoryNode, user: TelegramUser,
+                       cursor: Optional[int] = None):
+    _, item_ids, previous, following = category.get_page(cursor, settings.MODELS_PAGE_SIZE)
+
+    pages = []
+    if previous is not None:
+        pages.append(InlineKeyboardButton(Message.get("prev", user.language),
+                                          callback_data=f"items,{category.id},list,{previous}"))
+    if following is not None:
+        pages.append(InlineKeyboardButton(Message.get("next", user.language),
+                                          callback_data=f"items,{category.id},list,{following}"))
+
+    controls = get_category_controls(update, context, category, user)
     keyboard = InlineKeyboardMarkup(
-        [[InlineKeyboardButton(f'{Message.get("model", user.language)} {i}',
-                               callback_data=f"items,{item.category_id},get,{item.pk}")
-          for i, item in chunk]
-         for chunk in chunks(list(enumerate(category.items.order_by('pk'), 1)), 2)]
+        [[InlineKeyboardButton(category.get_item_label(item_id, user.language),
+                               callback_data=f"items,{category.id},get,{item_id}")
+          for item_id in chunk]
+         for chunk in chunks(item_ids, 2)]
+        + ([pages] if pages else [])
         + [controls])
     update.effective_message.reply_text(render(Message.get('submenu', user.language),
                                                {
@@ -190,84 +227,176 @@ def show_category_list(update: Update, context: CallbackContext, category: Categ
                                         parse_mode=ParseMode.HTML)
 
 
-@inject_user
-def show_item(update: Update, context: CallbackContext, item: Item, user: TelegramUser):
-    show_covers(update, context, item.covers.all())
+def build_item_card(item_id: int, category: CategoryNode, language, tree) -> Optional[ItemCard]:
+    item = Item.objects.filter(pk=item_id, category_id=category.id).annotate(cover_count=Count('covers')).first()
+    if item is None:
+        return None
 
     controls = [
-        InlineKeyboardButton(Message.get("all_categories", user.language), callback_data='menu')
+        InlineKeyboardButton(Message.get("all_categories", language), callback_data='menu')
     ]
 
-    if item.category.has_models:
-        controls = [InlineKeyboardButton(Message.get("back", user.language),
-                                         callback_data=item.category.get_callback_data())] + controls
-    elif item.category.parent is not None:
-        controls = [InlineKeyboardButton(Message.get("back", user.language),
-                                         callback_data=item.category.parent.get_callback_data())] + controls
+    parent = tree.get_parent(category)
+    if category.has_models:
+        controls = [InlineKeyboardButton(Message.get("back", language),
+                                         callback_data=category.callback_data)] + controls
+    elif parent is not None:
+        controls = [InlineKeyboardButton(Message.get("back", language),
+                                         callback_data=parent.callback_data)] + controls
 
     keyboard = InlineKeyboardMarkup(
         [
             [
-                InlineKeyboardButton(Message.get("prev", user.language),
+                InlineKeyboardButton(Message.get("prev", language),
                                      callback_data=f'items,{item.category_id},prev,{item.pk}'),
-                InlineKeyboardButton(Message.get("next", user.language),
+                InlineKeyboardButton(Message.get("next", language),
                                      callback_data=f'items,{item.category_id},next,{item.pk}')
             ]
         ] + [controls])
 
-    update.effective_message.reply_text(
-        render(Message.get('item', user.language), {'item': item, 'entries': item.get_entries(user.language)}),
-        reply_markup=keyboard,
-        parse_mode=ParseMode.HTML)
+    position = category.get_position(item.pk)
+    text = render(Message.get('item', language), {
+        'item': item,
+        'entries': list(item.get_entries(language)),
+        'position': position + 1 if position is not None else None,
+        'count': len(category.item_ids)
+    })
+    return ItemCard(text=text, keyboard=keyboard, has_covers=item.cover_count > 0)
+
+
+@inject_user
+def show_item(update: Update, context: CallbackContext, category: CategoryNode, item_id: int, user: TelegramUser):
+    request = get_request(update, context)
+    card = cards.get(item_id, user.language_id, (request.catalog.version, request.navigation.version),
+                     lambda: build_item_card(item_id, category, user.language, request.navigation))
+    if card is None:
+        return
+
+    if card.has_covers:
+        show_covers(update, context, Cover.objects.filter(item_id=item_id))
+
+    update.effective_message.reply_text(card.text, reply_markup=card.keyboard, parse_mode=ParseMode.HTML)
+
+
+@inject_user
+def show_search_results(update: Update, context: CallbackContext, query: str, user: TelegramUser, offset: int = 0):
+    request = get_request(update, context)
+    tree = request.navigation
+    language = request.language
+    page_size = settings.SEARCH_PAGE_SIZE
+    # One result more than the page tells whether there is a next page
+    results = [(item_id, title, tree.get_item_category(item_id)) for item_id, title in
+               search_index.get().search(query, language.pk if language else None, limit=offset + page_size + 1)]
+    results = [result for result in results if result[2] is not None]
+
+    if not results:
+        update.effective_message.reply_text(render(Message.get('search_nothing_found', user.language),
+                                                   {'query': query}),
+                                            parse_mode=ParseMode.HTML)
+        return
+
+    pages = []
+    if offset > 0:
+        pages.append(InlineKeyboardButton(Message.get("prev", user.language),
+                                          callback_data=f"search,{max(0, offset - page_size)}"))
+    if len(results) > offset + page_size:
+        pages.append(InlineKeyboardButton(Message.get("next", user.language),
+                                          callback_data=f"search,{offset + page_size}"))
+
+    page = results[offset:offset + page_size]
+    keyboard = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(shorten(title, BUTTON_TITLE_LENGTH) or category.get_item_label(item_id, user.language),
+                               callback_data=f"items,{category.id},get,{item_id}")]
+         for item_id, title, category in page]
+        + ([pages] if pages else [])
+        + [[InlineKeyboardButton(Message.get("all_categories", user.language), callback_data='menu')]])
+    update.effective_message.reply_text(render(Message.get('search_results', user.language), {
+        'query': query,
+        'start': offset + 1,
+        'end': offset + len(page),
+    }), reply_markup=keyboard, parse_mode=ParseMode.HTML)
+
+
+def answer_inline_query(update: Update, context: CallbackContext):
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    page_size = settings.INLINE_PAGE_SIZE
+
+    # Inline queries come from any chat, the language is only known for users the bot has seen recently
+    translations = catalog.get()
+    user = sessions.peek(query.from_user.id)
+    language = translations.get_language(user.language_id) if user is not None else None
+    language = language or translations.default_language
+
+    tree = navigation.get()
+    item_ids = []
+    if query.query.strip():
+        item_ids = [item_id for item_id, _ in search_index.get().search(
+            query.query, language.pk if language else None, limit=offset + page_size + 1)
+                    if tree.get_item_category(item_id) is not None]
+
+    results = inline_catalog.get()
+    page = [results.get_result(language, item_id, tree) for item_id in item_ids[offset:offset + page_size]]
+    query.answer([result for result in page if result is not None],
+                 cache_time=settings.INLINE_CACHE_TIME,
+                 is_personal=len(translations.languages) > 1,
+                 next_offset=str(offset + page_size) if len(item_ids) > offset + page_size else "")
 
 
-@run_async
 def process_callback(update: Update, context: CallbackContext):
     query, *args = update.callback_query.data.split(',')
     if query == 'menu':
         show_menu(update, context)
     elif query == 'items':
         category_id, action, *args = args
-        category = Category.objects.get(pk=category_id)
+        category = get_request(update, context).navigation.get_category(category_id)
 
-        if action == 'list':
-            show_category_list(update, context, category)
+        if category is None:
+            pass
+        elif action == 'list':
+            show_category_list(update, context, category, cursor=int(args[0]) if args else None)
         else:
-            item = None
+            item_id = None
             if action == 'get':
-                item = category.items.get(pk=args[0])
+                item_id = int(args[0])
             elif action == "begin":
-                item = category.items.first()
+                item_id = category.item_ids[0] if category.item_ids else None
             elif action == 'next':
-                item = category.items.filter(pk__gt=int(args[0])).first()
+                item_id = category.get_neighbour(int(args[0]), 1)
             elif action == 'prev':
-                item = category.items.filter(pk__lt=int(args[0])).last()
+                item_id = category.get_neighbour(int(args[0]), -1)
 
-            if item is not None:
-                show_item(update, context, item)
+            # The index only knows items of this category
+            if item_id is not None and category.get_position(item_id) is not None:
+                show_item(update, context, category, item_id)
     elif query == 'submenu':
-        category_id = args[0]
-        category = Category.objects.get(pk=category_id)
+        category = get_request(update, context).navigation.get_category(args[0])
 
-        show_submenu(update, context, category)
+        if category is not None:
+            show_submenu(update, context, category)
     elif query == "info":
         info_id = args[0]
         info = InfoButton.objects.get(pk=info_id)
 
         show_info(update, context, info)
+    elif query == 'search':
+        search_query = context.user_data.get('search')
+
+        if search_query:
+            show_search_results(update, context, search_query, offset=int(args[0]))
 
     update.callback_query.answer()
 
 
 @inject_user
 def ask_language(update: Update, context: Context, user: TelegramUser):
-    buttons = [language.name for language in MessageLanguage.objects.all()]
+    buttons = [language.name for language in get_request(update, context).catalog.languages]
     markup = [chunk for chunk in chunks(buttons, 2)]
     if user.language is not None:
         markup.append([Message.get("cancel_button", user.language)])
 
     keyboard = ReplyKeyboardMarkup(markup, resize_keyboard=True)
-    update.message.reply_text(render(Message.get("language", MessageLanguage.objects.get(default=True))),
+    update.message.reply_text(render(Message.get("language", None)),
                               reply_markup=keyboard, parse_mode=ParseMode.HTML)
     return LANGUAGE
 
@@ -300,13 +429,18 @@ def ask_full_name(update: Update, context: CallbackContext, user: TelegramUser):
 
 @inject_user
 def start(update: Update, context: CallbackContext, user: TelegramUser):
-    if context.user_data.get('created', False) and context.args:
+    if get_request(update, context).created and context.args:
         try:
             user.referrer = TelegramUser.objects.get(pk=context.args[0])
-            user.save()
+            user.save(update_fields=['referrer'])
         except TelegramUser.DoesNotExist:
             pass
 
+    if user.language is None or not user.real_name or not user.phone:
+        # The answers may have been saved by another worker process, whose sessions don't reach ours
+        user.refresh_from_db(fields=['language', 'real_name', 'phone'])
+        user.language = get_request(update, context).catalog.get_language(user.language_id)
+
     if user.language is None:
         return ask_language(update, context)
     if not user.real_name:
@@ -318,43 +452,41 @@ def start(update: Update, context: CallbackContext, user: TelegramUser):
     return ConversationHandler.END
 
 
-@run_async
 @inject_user
 def get_help(update: Update, context: CallbackContext, user: TelegramUser):
     update.message.reply_text(render(Message.get("help", user.language)),
                               parse_mode=ParseMode.HTML)
 
 
-@run_async
 @inject_user
 def get_personal_stats(update: Update, context: CallbackContext, user: TelegramUser):
     update.message.reply_text(render(Message.get("personal_stats", user.language), {
         'user': user,
         'chat_id': update.message.from_user.id,
-        'days': (timezone.now() - user.joined).days
+        'days': (timezone.now() - user.joined).days,
+        'referrals': get_personal_referral_stats(user) if user.is_manager or user.is_admin else None
     }), parse_mode=ParseMode.HTML, reply_markup=get_main_keyboard(update, context))
 
 
-@run_async
+@inject_user
+def search(update: Update, context: CallbackContext, user: TelegramUser):
+    query = " ".join(context.args) if context.args is not None else update.message.text
+    if not query.strip():
+        update.message.reply_text(render(Message.get("search_prompt", user.language)), parse_mode=ParseMode.HTML)
+        return
+
+    # Pages of the results are requested by callbacks, which have no room for the query
+    context.user_data['search'] = query
+    show_search_results(update, context, query)
+
+
 @is_admin
 @inject_user
 def get_stats(update: Update, context: CallbackContext, user: TelegramUser):
-    update.effective_message.reply_text(render(Message.get("stats", user.language), {
-        'days': (now() - settings.LAUNCH_DATE).days,
-        'total_users': TelegramUser.objects.count(),
-        'new_users_today': TelegramUser.objects.filter(joined__gte=timezone.now() - dt.timedelta(days=1)).count(),
-        'data': [{
-            'profile': tg_user,
-            'today': TelegramUser.objects.filter(referrer=tg_user,
-                                                 joined__gte=timezone.now() - dt.timedelta(days=1)).count(),
-            'total': TelegramUser.objects.filter(referrer=tg_user).count()
-        } for tg_user in TelegramUser.objects.filter(is_manager=True)
-                                               .annotate(total_referrals=Count('referrals'))
-                                               .order_by('-total_referrals')]
-    }), parse_mode=ParseMode.HTML)
+    update.effective_message.reply_text(render(Message.get("stats", user.language), get_referral_stats()),
+                                        parse_mode=ParseMode.HTML)
 
 
-@run_async
 @is_manager
 @inject_user
 def get_invite_link(update: Update, context: CallbackContext, user: TelegramUser):
@@ -365,15 +497,14 @@ def get_invite_link(update: Update, context: CallbackContext, user: TelegramUser
 
 @inject_user
 def process_language(update: Update, context: CallbackContext, user: TelegramUser):
-    try:
-        language = MessageLanguage.objects.get(name=update.message.text)
-    except MessageLanguage.DoesNotExist:
+    language = get_request(update, context).catalog.find_language(update.message.text)
+    if language is None:
         update.message.reply_text(Message.get("wrong_language", user.language), parse_mode=ParseMode.HTML)
         return False
 
     # Saving
     user.language = language
-    user.save()
+    user.save(update_fields=['language'])
 
     return True
 
@@ -381,7 +512,7 @@ def process_language(update: Update, context: CallbackContext, user: TelegramUse
 @inject_user
 def process_full_name(update: Update, context: CallbackContext, user: TelegramUser):
     user.real_name = update.message.text
-    user.save()
+    user.save(update_fields=['real_name'])
 
 
 def update_full_name(update: Update, context: CallbackContext):
@@ -419,6 +550,13 @@ def set_language(update: Update, context: CallbackContext):
     return FULL_NAME
 
 
+@inject_user
+def reject_typed_phone(update: Update, context: CallbackContext, user: TelegramUser):
+    # Only a shared contact is accepted, typed text must not end up as a search
+    update.message.reply_text(render(Message.get("wrong_phone", user.language)), parse_mode=ParseMode.HTML)
+    return PHONE
+
+
 @inject_user
 def set_phone(update: Update, context: CallbackContext, user: TelegramUser):
     if update.message.contact.user_id != update.message.chat_id:
@@ -426,14 +564,13 @@ def set_phone(update: Update, context: CallbackContext, user: TelegramUser):
         return PHONE
 
     user.phone = update.message.contact.phone_number
-    user.save()
+    user.save(update_fields=['phone'])
 
     show_menu(update, context)
 
     return ConversationHandler.END
 
 
-@run_async
 def error(update: Update, context: CallbackContext):
     s = 'Update "%s" caused error "%s"' % (update, context.error)
     logger.warning(s)
@@ -441,10 +578,9 @@ def error(update: Update, context: CallbackContext):
         context.bot.send_message(settings.ADMIN_CHAT_ID, s)
 
 
-def main():
-    logger.info('Loading handlers for telegram bot')
-
-    dp = DjangoTelegramBot.dispatcher
+def register_handlers(dp):
+    # Resolves the user once per update, before any handler of group 0 runs
+    dp.add_handler(TypeHandler(Update, bind_request), group=-1)
 
     dp.add_handler(ConversationHandler(
         entry_points=[CommandHandler('start', start),
@@ -452,7 +588,8 @@ def main():
         states={
             LANGUAGE: [MessageHandler(Filters.text & ~Filters.command, set_language)],
             FULL_NAME: [MessageHandler(Filters.text & ~Filters.command, set_full_name)],
-            PHONE: [MessageHandler(Filters.contact, set_phone)]
+            PHONE: [MessageHandler(Filters.contact, set_phone),
+                    MessageHandler(Filters.text & ~Filters.command, reject_typed_phone)]
         },
         fallbacks=[],
         name="InitialConversation",
@@ -499,6 +636,42 @@ def main():
     dp.add_handler(CommandHandler('mstats', get_personal_stats))
     dp.add_handler(MessageHandler(Filters.text([KeyboardEntryPoint("profile_menu_button")]), get_personal_stats))
 
+    dp.add_handler(CommandHandler('search', search))
+
     dp.add_handler(CallbackQueryHandler(process_callback))
+    dp.add_handler(InlineQueryHandler(answer_inline_query))
+
+    # Any other text is a search query
+    dp.add_handler(MessageHandler(
+        Filters.text & ~Filters.command & ~Filters.text([KeyboardEntryPoint("cancel_button")]), search))
 
     dp.add_error_handler(error)
+
+
+def main():
+    logger.info('Loading handlers for telegram bot')
+
+    warm_up_templates()
+    sessions.start_flusher()
+
+    dp = DjangoTelegramBot.dispatcher
+    broadcaster.start(dp.bot)
+
+    # Updates of one chat run one after another, different chats run in parallel
+    updater = next((updater for updater in DjangoTelegramBot.updaters if updater.dispatcher is dp), None)
+    ChatExecutor().attach(dp, updater)
+    if settings.USE_WEBHOOK:
+        # Telegram redelivers updates it considers unanswered
+        updates.attach(dp)
+
+    # Must be set before the persistent conversation handlers are added.
+    # States of an earlier PicklePersistence are copied over by `manage.py import_persistence`
+    dp.persistence = DatabasePersistence()
+    dp.user_data = dp.persistence.get_user_data()
+
+    register_handlers(dp)
+
+    measure_dispatcher(dp)
+    measure_bot(dp.bot)
+    measure_bot(broadcaster.bot)
+    metrics.collect('bot_duplicate_updates_total', lambda: updates.dropped)
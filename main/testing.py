@@ -0,0 +1,191 @@
+"""
+Fake Telegram bot, synthetic updates and a seeded catalog for benchmarks and tests.
+"""
+import itertools
+import time
+
+from django.db import transaction
+from telegram import Bot, Update
+from telegram.ext import Dispatcher
+
+from main.counters import recount_items
+from main.models import MessageLanguage, Message, MessageValue, Category, CategoryName, Item, Entry, InfoButton, \
+    InfoButtonName, InfoButtonDescription, TelegramUser
+from main.persistence import DatabasePersistence
+from main.stats import rebuild_join_counts
+
+# Texts of every message the bot uses, {language} is replaced with the language name
+MESSAGES = {
+    'admin_access_required': "Access denied ({language})",
+    'all_categories': "All categories ({language})",
+    'back': "Back ({language})",
+    'cancel_button': "Cancel ({language})",
+    'change_full_name_button': "Change name ({language})",
+    'change_language_button': "Change language ({language})",
+    'full_name': "Your name? ({language})",
+    'help': "Help ({language})",
+    'help_button': "Help button ({language})",
+    'info': "{{{{ info_name }}}}\n{{{{ info_description }}}}",
+    'inline_item': "{{% for entry in entries %}}<b>{{{{ entry.description }}}}</b> {{{{ entry.price }}}}{{% endfor %}}",
+    'invite_link': "Invite ({language})",
+    'item': "{{% for entry in entries %}}<b>{{{{ entry.description }}}}</b> {{{{ entry.price }}}} {{{{ entry.currency }}}}"
+            "{{% endfor %}}\n{{{{ position }}}}/{{{{ count }}}}",
+    'language': "Language? ({language})",
+    'main_menu_button': "Main menu ({language})",
+    'menu': "Menu ({language})",
+    'menu_begin': "Welcome ({language})",
+    'model': "Model ({language})",
+    'next': "Next ({language})",
+    'personal_stats': "Profile ({language})",
+    'phone': "Phone? ({language})",
+    'phone_button': "Send phone ({language})",
+    'prev': "Previous ({language})",
+    'profile_menu_button': "Profile button ({language})",
+    'search_nothing_found': "Nothing found for {{{{ query }}}} ({language})",
+    'search_prompt': "Search for? ({language})",
+    'search_results': "{{{{ query }}}}: {{{{ start }}}}-{{{{ end }}}} ({language})",
+    'stats': "{{{{ total_users }}}} / {{{{ new_users_today }}}}\n"
+             "{{% for row in data %}}{{{{ row.profile }}}}: {{{{ row.today }}}} {{{{ row.total }}}}\n{{% endfor %}}",
+    'submenu': "Submenu ({language})",
+    'wrong_language': "Unknown language ({language})",
+    'wrong_phone': "Wrong phone ({language})",
+}
+
+
+class RecordingRequest:
+    """
+    Stands in for ``telegram.utils.request.Request``: records Bot API calls and answers them
+    with the smallest valid result, without any network.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._message_ids = itertools.count(1)
+
+    def _message(self, data):
+        return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': data.get('chat_id', 0), 'type': 'private'}}
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        self.calls.append((method, data))
+        if method == 'sendMediaGroup':
+            return [dict(self._message(data), photo=[{'file_id': f"photo{len(self.calls)}-{i}",
+                                                     'file_unique_id': f"photo{len(self.calls)}-{i}",
+                                                     'width': 640, 'height': 640}])
+                    for i, _ in enumerate(data['media'])]
+        if method.startswith('send') or method.startswith('edit'):
+            return self._message(data)
+        return True
+
+    def get(self, url, timeout=None):
+        return {'id': 123456, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+
+    def stop(self):
+        pass
+
+
+class FakeBot(Bot):
+    def __init__(self):
+        super().__init__('123456:fake', request=RecordingRequest())
+
+    @property
+    def calls(self):
+        return self._request.calls
+
+
+def make_dispatcher(bot=None):
+    """Dispatcher with the bot's handlers that processes updates in the calling thread."""
+    from main.telegrambot import register_handlers
+
+    dp = Dispatcher(bot or FakeBot(), None, workers=0, persistence=DatabasePersistence(), use_context=True)
+    register_handlers(dp)
+    return dp
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+
+    def _user(self, chat_id):
+        return {'id': chat_id, 'is_bot': False, 'first_name': f"User {chat_id}", 'username': f"user{chat_id}"}
+
+    def _message(self, chat_id, **fields):
+        update_id = next(self._update_ids)
+        return update_id, dict({'message_id': update_id, 'date': int(time.time()),
+                                'chat': {'id': chat_id, 'type': 'private'}, 'from': self._user(chat_id)}, **fields)
+
+    def message(self, chat_id, text):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] if text.startswith('/') else []
+        update_id, message = self._message(chat_id, text=text, entities=entities)
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+
+    def contact(self, chat_id, phone):
+        update_id, message = self._message(chat_id, contact={'phone_number': phone, 'first_name': f"User {chat_id}",
+                                                             'user_id': chat_id})
+        return Update.de_json({'update_id': update_id, 'message': message}, self.bot)
+
+    def inline_query(self, user_id, query, offset=""):
+        update_id = next(self._update_ids)
+        return Update.de_json({'update_id': update_id, 'inline_query': {
+            'id': str(update_id), 'from': self._user(user_id), 'query': query, 'offset': offset
+        }}, self.bot)
+
+    def callback(self, chat_id, data):
+        update_id, message = self._message(chat_id)
+        return Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'data': data, 'chat_instance': str(chat_id),
+            'from': self._user(chat_id), 'message': message
+        }}, self.bot)
+
+
+@transaction.atomic
+def seed_catalog(sections=2, categories=5, items=20, infos=2, users=100, languages=('ru', 'uz')):
+    """
+    Creates messages in every language and a catalog of ``sections`` super categories with
+    ``categories`` categories of ``items`` items each. A tenth of ``users`` are managers who
+    invited the rest, the first user is an admin.
+    """
+    languages = [MessageLanguage.objects.create(name=name, default=not i) for i, name in enumerate(languages)]
+    for name, text in MESSAGES.items():
+        # Messages created by data migrations already exist
+        message, _ = Message.objects.get_or_create(name=name)
+        MessageValue.objects.bulk_create(MessageValue(message=message, language=language,
+                                                      text=text.format(language=language.name))
+                                         for language in languages)
+
+    def add_names(model, button, name):
+        model.objects.bulk_create(model(button=button, language=language, name=f"{name} {language.name}")
+                                  for language in languages)
+
+    for s in range(sections):
+        section = Category.objects.create(has_models=False, priority=s)
+        add_names(CategoryName, section, f"Section {s}")
+        for c in range(categories):
+            category = Category.objects.create(has_models=bool(c % 2), parent=section, priority=c)
+            add_names(CategoryName, category, f"Category {s}.{c}")
+            Item.objects.bulk_create(Item(category=category, number=i if c % 2 else None) for i in range(items))
+            category_items = list(Item.objects.filter(category=category).order_by('pk'))
+            Entry.objects.bulk_create(Entry(item=item, language=language, description=f"Item {item.pk}",
+                                            long_description="Description", price=100 * (item.pk % 50 + 1))
+                                      for item in category_items for language in languages)
+    recount_items()
+
+    for i in range(infos):
+        info = InfoButton.objects.create(priority=-i - 1)
+        add_names(InfoButtonName, info, f"Info {i}")
+        InfoButtonDescription.objects.bulk_create(
+            InfoButtonDescription(button=info, language=language, description=f"Info {i} {language.name}")
+            for language in languages)
+
+    managers = [TelegramUser.objects.create(chat_id=1000 + i, full_name=f"Manager {i}", real_name=f"Manager {i}",
+                                            phone="+998900000000", language=languages[i % len(languages)],
+                                            is_manager=True, is_admin=not i)
+                for i in range(max(1, users // 10))]
+    TelegramUser.objects.bulk_create(
+        TelegramUser(chat_id=100000 + i, full_name=f"User {i}", real_name=f"User {i}", phone="+998900000000",
+                     language=languages[i % len(languages)], referrer=managers[i % len(managers)])
+        for i in range(users - len(managers)))
+    rebuild_join_counts()
+    return languages
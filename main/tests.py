@@ -1,3 +1,523 @@
+import datetime as dt
+import io
+import json
+import os
+import pickle
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from main.broadcasts import Broadcaster
+from main.cards import cards
+from main.counters import recount_items
+from main.inline import inline_catalog
+from main.models import TelegramUser, Message, MessageLanguage, Broadcast, BroadcastRecipient, InfoButton, Item, \
+    Category, Cover, DailyJoinCount, Entry, UserData, Lease, ConversationState
+from main.navigation import navigation, load_navigation
+from main.persistence import DatabasePersistence, LazyUserData, dump_key
+from main.search import search_index
+from main.sessions import sessions
+from main.signals import recount_after_category_deletes
+from main.stats import add_join
+from main.telegrambot import BUTTON_TITLE_LENGTH
+from main.testing import seed_catalog, make_dispatcher, UpdateFactory, FakeBot
+from main.translations import catalog, load_catalog
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Every test states how many queries a request may run at most. Budgets must not depend on
+    the catalog size, so the large-catalog subclasses run the same tests with the same budgets.
+    """
+
+    catalog_size = {'sections': 2, 'categories': 3, 'items': 4, 'users': 20}
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(**cls.catalog_size)
+
+    def setUp(self):
+        # In-process caches would otherwise keep objects of the previous test's transaction
+        catalog.invalidate()
+        navigation.invalidate()
+        search_index.invalidate()
+        inline_catalog.invalidate()
+        cards.clear()
+        sessions.clear()
+        cache.clear()
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with CaptureQueriesContext(connection) as context:
+            yield
+        if len(context) > budget:
+            queries = "\n".join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, 1))
+            self.fail(f"{len(context)} queries executed, at most {budget} expected\n"
+                      f"Captured queries were:\n{queries}")
+
+
+class SnapshotQueryBudgetTest(QueryBudgetTestCase):
+    def test_load_catalog(self):
+        with self.assertMaxQueries(2):
+            load_catalog()
+
+    def test_load_navigation(self):
+        with self.assertMaxQueries(6):
+            load_navigation()
+
+    def test_content_versions(self):
+        tree, translations = navigation.get(), catalog.get()
+        self.assertEqual(load_navigation().version, tree.version)
+        self.assertEqual(load_catalog().version, translations.version)
+
+        Item.objects.filter(pk=Item.objects.last().pk).delete()
+        Message.objects.first().values.update(text="Changed")
+        self.assertNotEqual(load_navigation().version, tree.version)
+        self.assertNotEqual(load_catalog().version, translations.version)
+
+
+class HandlerQueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = make_dispatcher()
+        self.errors = []
+        self.dispatcher.error_handlers.clear()
+        self.dispatcher.add_error_handler(lambda update, context: self.errors.append(context.error))
+        self.updates = UpdateFactory(self.dispatcher.bot)
+
+        self.tree = navigation.get()
+        self.section = next(node for node in self.tree.menu if getattr(node, 'children', None))
+        categories = [self.tree.get_category(pk) for pk in self.section.children]
+        self.listed = next(category for category in categories if category.has_models)
+        self.browsed = next(category for category in categories if not category.has_models)
+        self.info = next(node for node in self.tree.menu if not hasattr(node, 'children'))
+
+        self.user = TelegramUser.objects.filter(is_admin=False, is_manager=False).first()
+        self.admin = TelegramUser.objects.filter(is_admin=True).first()
+        self.manager = TelegramUser.objects.filter(is_manager=True, is_admin=False).first() or self.admin
+
+        # Warm up the snapshots and the users' sessions, budgets are for the steady state
+        for user in (self.user, self.admin, self.manager):
+            self.process(self.updates.callback(user.chat_id, 'menu'))
+
+    def process(self, *updates):
+        for update in updates:
+            self.dispatcher.process_update(update)
+        if self.errors:
+            raise self.errors[0]
+
+    def assertBudget(self, budget, *updates):
+        with self.assertMaxQueries(budget):
+            self.process(*updates)
+        self.assertTrue(self.dispatcher.bot.calls)
+
+    def test_menu(self):
+        self.assertBudget(0, self.updates.callback(self.user.chat_id, 'menu'))
+
+    def test_submenu(self):
+        self.assertBudget(0, self.updates.callback(self.user.chat_id, self.section.callback_data))
+
+    def test_category_list(self):
+        self.assertBudget(0, self.updates.callback(self.user.chat_id, f"items,{self.listed.id},list"))
+
+    def test_category_list_page(self):
+        self.assertBudget(0, self.updates.callback(self.user.chat_id, f"items,{self.listed.id},list,1"))
+
+    def test_item(self):
+        self.assertBudget(2, self.updates.callback(self.user.chat_id, f"items,{self.browsed.id},begin"))
+
+    def test_cached_item(self):
+        self.process(self.updates.callback(self.user.chat_id, f"items,{self.browsed.id},begin"))
+        self.assertBudget(0, self.updates.callback(self.admin.chat_id, f"items,{self.browsed.id},begin"))
+
+    def test_item_neighbours(self):
+        first, last = self.browsed.item_ids[0], self.browsed.item_ids[-1]
+        self.assertBudget(2, self.updates.callback(self.user.chat_id, f"items,{self.browsed.id},next,{first}"))
+        self.assertBudget(2, self.updates.callback(self.user.chat_id, f"items,{self.browsed.id},prev,{last}"))
+
+    def test_info(self):
+        self.assertBudget(5, self.updates.callback(self.user.chat_id, self.info.callback_data))
+
+    def test_search(self):
+        self.process(self.updates.message(self.admin.chat_id, '/search warm up'))
+        self.assertBudget(6, self.updates.message(self.user.chat_id, '/search item'))
+        self.assertBudget(0, self.updates.callback(self.user.chat_id, 'search,10'))
+        self.assertBudget(6, self.updates.message(self.user.chat_id, 'Descriptoin'))
+
+        item_id = self.browsed.item_ids[-1]
+        self.process(self.updates.message(self.user.chat_id, f"/search Item {item_id}"))
+        keyboard = json.loads(self.dispatcher.bot.calls[-1][1]['reply_markup'])['inline_keyboard']
+        self.assertEqual(keyboard[0][0]['callback_data'], f"items,{self.browsed.id},get,{item_id}")
+
+    def test_search_button_titles(self):
+        untitled, titled = self.browsed.item_ids[:2]
+        Entry.objects.filter(item_id=untitled).update(description='', long_description="Zanzibar")
+        Entry.objects.filter(item_id=titled).update(description="Zanzibar " + "long " * 50)
+        search_index.invalidate()
+
+        self.process(self.updates.message(self.user.chat_id, '/search zanzibar'))
+        keyboard = json.loads(self.dispatcher.bot.calls[-1][1]['reply_markup'])['inline_keyboard']
+        titles = {row[0]['callback_data']: row[0]['text'] for row in keyboard[:2]}
+        self.assertEqual(titles[f"items,{self.browsed.id},get,{untitled}"],
+                         f"{Message.get('model', self.user.language)} 1")
+        self.assertEqual(len(titles[f"items,{self.browsed.id},get,{titled}"]), BUTTON_TITLE_LENGTH)
+
+    def test_inline_query(self):
+        item_id = self.browsed.item_ids[0]
+        # Without save(), which would process the missing file
+        Cover.objects.bulk_create([Cover(item_id=item_id, file='covers/cover.jpg', telegram_file_id='cover')])
+        self.process(self.updates.inline_query(self.admin.chat_id, 'warm up'))
+
+        self.assertBudget(0, self.updates.inline_query(self.user.chat_id, f"Item {item_id}"))
+        answer = self.dispatcher.bot.calls[-1][1]
+        results = answer['results']
+        self.assertEqual(results[0], {'type': 'photo', 'id': str(item_id), 'photo_file_id': 'cover',
+                                      'title': f"Item {item_id}", 'description': "Description",
+                                      'caption': mock.ANY, 'parse_mode': 'HTML'})
+
+        self.assertBudget(0, self.updates.inline_query(self.user.chat_id, 'ite'))
+        self.assertEqual(self.dispatcher.bot.calls[-1][1]['next_offset'], '20')
+        self.assertBudget(0, self.updates.inline_query(self.user.chat_id, 'ite', '20'))
+
+    def test_inline_result_fallbacks(self):
+        untitled, titled = self.browsed.item_ids[:2]
+        Cover.objects.bulk_create([Cover(item_id=titled, file='covers/cover.jpg', telegram_file_id='cover')])
+        Entry.objects.filter(item_id=untitled).update(description='', long_description="Zanzibar")
+        Entry.objects.filter(item_id=titled).update(description="Zanzibar " + "long & " * 200)
+        search_index.invalidate()
+        inline_catalog.invalidate()
+
+        self.process(self.updates.inline_query(self.user.chat_id, 'zanzibar'))
+        results = {result['id']: result for result in self.dispatcher.bot.calls[-1][1]['results']}
+        self.assertEqual(results[str(untitled)]['title'], f"{Message.get('model', self.user.language)} 1")
+        caption = results[str(titled)]['caption']
+        self.assertEqual(len(caption), 1024)
+        self.assertTrue(caption.startswith("Zanzibar long & long"))
+        self.assertNotIn('parse_mode', results[str(titled)])
+
+    def test_help(self):
+        self.assertBudget(0, self.updates.message(self.user.chat_id, '/help'))
+
+    def test_personal_stats(self):
+        self.assertBudget(0, self.updates.message(self.user.chat_id, '/mstats'))
+
+    def test_manager_personal_stats(self):
+        self.assertBudget(1, self.updates.message(self.manager.chat_id, '/mstats'))
+
+    def test_invite_link(self):
+        self.assertBudget(0, self.updates.message(self.manager.chat_id, '/invite'))
+
+    def test_stats(self):
+        self.assertBudget(2, self.updates.message(self.admin.chat_id, '/stats'))
+
+    def test_change_language(self):
+        self.assertBudget(2, self.updates.message(self.user.chat_id, '/lang'))
+        self.assertBudget(7, self.updates.message(self.user.chat_id, 'uz'))
+
+    def test_onboarding(self):
+        chat_id = 10 ** 9
+        self.assertBudget(13, self.updates.message(chat_id, '/start'))
+        self.assertBudget(4, self.updates.message(chat_id, 'ru'))
+        self.assertBudget(2, self.updates.message(chat_id, 'Full Name'))
+        self.assertBudget(0, self.updates.message(chat_id, '+998901234567'))
+        self.assertEqual(self.dispatcher.bot.calls[-1][1]['text'],
+                         Message.get('wrong_phone', catalog.get().find_language('ru')))
+        self.assertBudget(2, self.updates.contact(chat_id, '+998901234567'))
+
+    def test_referral_start(self):
+        chat_id = 10 ** 9
+        self.assertBudget(20, self.updates.message(chat_id, f"/start {self.manager.pk}"))
+
+
+class AdminQueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def assertChangelistBudget(self, model, budget, **params):
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        with self.assertMaxQueries(budget):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertChangeFormBudget(self, instance, budget):
+        url = reverse(f'admin:{instance._meta.app_label}_{instance._meta.model_name}_change', args=[instance.pk])
+        with self.assertMaxQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def assertAutocompleteBudget(self, model, budget, term):
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_autocomplete')
+        with self.assertMaxQueries(budget):
+            response = self.client.get(url, {'term': term})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_message_changelist(self):
+        self.assertChangelistBudget(Message, 5)
+
+    def test_message_language_changelist(self):
+        self.assertChangelistBudget(MessageLanguage, 5)
+
+    def test_broadcast_changelist(self):
+        self.assertChangelistBudget(Broadcast, 5)
+
+    def test_broadcast_recipient_changelist(self):
+        self.assertChangelistBudget(BroadcastRecipient, 6)
+
+    def test_info_button_changelist(self):
+        self.assertChangelistBudget(InfoButton, 6)
+
+    def test_item_changelist(self):
+        self.assertChangelistBudget(Item, 9)
+
+    def test_item_search(self):
+        wardrobe, table = Item.objects.filter(number=None)[:2]
+        Entry.objects.filter(item=wardrobe).update(description="Oak wardrobe")
+        Entry.objects.filter(item=table).update(description="Oak table")
+        response = self.assertChangelistBudget(Item, 9, q="oak robe")
+        self.assertEqual(list(response.context['cl'].result_list), [wardrobe])
+
+        model = Item.objects.exclude(number=None).last()
+        response = self.assertChangelistBudget(Item, 9, q=str(model.number))
+        self.assertIn(model, response.context['cl'].result_list)
+
+    def test_category_changelist(self):
+        self.assertChangelistBudget(Category, 6)
+
+    def test_telegram_user_changelist(self):
+        self.assertChangelistBudget(TelegramUser, 5)
+
+    # Related objects are picked through autocomplete lookups, change forms don't list them
+    def test_telegram_user_change_form(self):
+        self.assertChangeFormBudget(TelegramUser.objects.filter(referrer__isnull=False).last(), 8)
+
+    def test_item_change_form(self):
+        self.assertChangeFormBudget(Item.objects.last(), 14)
+
+    def test_category_change_form(self):
+        self.assertChangeFormBudget(Category.objects.filter(parent__isnull=False).last(), 12)
+
+    def test_telegram_user_autocomplete(self):
+        manager = TelegramUser.objects.filter(is_manager=True).first()
+        self.assertIn({'id': str(manager.pk), 'text': manager.full_name},
+                      self.assertAutocompleteBudget(TelegramUser, 5, manager.full_name.split()[0]))
+        self.assertEqual([{'id': str(manager.pk), 'text': manager.full_name}],
+                         self.assertAutocompleteBudget(TelegramUser, 5, str(manager.chat_id)))
+
+    def test_telegram_user_search(self):
+        user = TelegramUser.objects.create(chat_id=777, full_name="Ivan Petrov", username="ivan_2024")
+        for term in ["petrov", "2024", "777"]:
+            response = self.assertChangelistBudget(TelegramUser, 5, q=term)
+            self.assertEqual(list(response.context['cl'].result_list), [user])
+
+    def test_category_autocomplete(self):
+        self.assertTrue(self.assertAutocompleteBudget(Category, 6, 'Section'))
+
+
+class CategoryCounterTest(TestCase):
+    def setUp(self):
+        seed_catalog(sections=1, categories=2, items=10, users=1)
+        self.section = Category.objects.get(parent=None)
+        self.deleted, self.kept = Category.objects.filter(parent=self.section).order_by('pk')
+        subcategory = Category.objects.create(has_models=True, parent=self.deleted, priority=0)
+        Item.objects.bulk_create(Item(category=subcategory) for _ in range(10))
+        recount_items()
+
+    def test_category_delete_recounts_ancestors_once(self):
+        with mock.patch('main.signals.add_items') as add_items:
+            self.deleted.delete()
+        add_items.assert_not_called()
+        # Test cases never commit
+        recount_after_category_deletes()
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.total_items, 10)
+
+    def test_item_delete_is_counted(self):
+        Item.objects.filter(category=self.kept).first().delete()
+        self.section.refresh_from_db()
+        self.assertEqual(self.section.total_items, 29)
+
+
+class JoinCountTest(TestCase):
+    def test_joins_without_referrer_and_language_share_a_row(self):
+        now = timezone.now()
+        add_join(now, None, None, 1)
+        add_join(now, None, None, 1)
+        self.assertEqual(list(DailyJoinCount.objects.values_list('count', flat=True)), [2])
+
+    def test_concurrent_first_join_adds_to_the_existing_row(self):
+        now = timezone.now()
+        DailyJoinCount.objects.create(date=timezone.localdate(now), count=1)
+        update = QuerySet.update
+
+        def update_before_other_worker(queryset, **kwargs):
+            # The first update runs before the other worker's row exists
+            return update(queryset, **kwargs) if mocked.call_count > 1 else 0
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_before_other_worker) as mocked:
+            add_join(now, None, None, 1)
+        self.assertEqual(list(DailyJoinCount.objects.values_list('count', flat=True)), [2])
+
+
+class JoinKeyTest(TestCase):
+    def setUp(self):
+        self.language = MessageLanguage.objects.create(name='uz')
+        self.cached = TelegramUser.objects.create(chat_id=1)
+
+    def counts(self):
+        return list(DailyJoinCount.objects.filter(count__gt=0).values_list('language_id', 'count'))
+
+    def save_language_elsewhere(self):
+        other = TelegramUser.objects.get(pk=self.cached.pk)
+        other.language = self.language
+        other.save(update_fields=['language'])
+
+    def test_refreshed_user_keeps_its_join(self):
+        self.save_language_elsewhere()
+        self.cached.refresh_from_db(fields=['language', 'real_name', 'phone'])
+        self.cached.phone = "+998"
+        self.cached.save()
+        self.assertEqual(self.counts(), [(self.language.pk, 1)])
+
+    def test_saving_other_fields_keeps_the_join(self):
+        self.save_language_elsewhere()
+        self.cached.phone = "+998"
+        self.cached.save(update_fields=['phone'])
+        self.assertEqual(self.counts(), [(self.language.pk, 1)])
+
+
+class UserDataTest(TestCase):
+    def setUp(self):
+        self.persistence = DatabasePersistence()
+        self.user_data = self.persistence._user_data = LazyUserData(size=2)
+
+    def test_saved_entries_are_dropped(self):
+        self.user_data[1]['search'] = "chair"
+        self.persistence.update_user_data(1, self.user_data[1])
+        self.user_data[2], self.user_data[3]
+        self.assertEqual(sorted(self.user_data), [2, 3])
+        self.assertEqual(self.user_data[1], {'search': "chair"})
+
+    def test_unsaved_entries_are_kept(self):
+        self.user_data[1]['search'] = "chair"
+        self.user_data[2], self.user_data[3]
+        self.assertEqual(sorted(self.user_data), [1, 3])
+
+    def test_held_entries_come_back(self):
+        held = self.user_data[1]
+        self.user_data[2], self.user_data[3]
+        held['search'] = "chair"
+        self.assertIs(self.user_data[1], held)
+        self.persistence.update_user_data(1, held)
+        self.assertEqual(UserData.objects.get(user_id=1).data, '{"search": "chair"}')
+
+
+class SendListTest(TestCase):
+    def setUp(self):
+        seed_catalog(sections=1, categories=1, items=1, users=5)
+
+    def test_first_page_has_etag(self):
+        response = self.client.get('/sendlist', {'limit': 2})
+        self.assertIn('ETag', response)
+        self.assertEqual(self.client.get('/sendlist', {'limit': 2}, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         304)
+
+    def test_next_pages_skip_etag(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/sendlist', {'limit': 2, 'after': 0})
+        self.assertNotIn('ETag', response)
+
+
+class MetricsTest(TestCase):
+    def test_anonymous_is_refused(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+
+    def test_token_and_staff_are_allowed(self):
+        with self.settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class ImportPersistenceTest(TestCase):
+    def test_pickle_states_are_imported_once(self):
+        ConversationState.objects.create(name="InitialConversation", key=dump_key((2, 2)), state="1")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'persistence')
+            with open(filename, 'wb') as file:
+                pickle.dump({'conversations': {'InitialConversation': {(1, 1): 2, (2, 2): 0, (3, 3): None}},
+                             'user_data': {1: {'search': "chair"}, 2: {}}, 'chat_data': {}}, file)
+            call_command('import_persistence', filename, stdout=io.StringIO())
+
+        self.assertEqual(sorted(ConversationState.objects.values_list('key', 'state')),
+                         [(dump_key((1, 1)), "2"), (dump_key((2, 2)), "1")])
+        self.assertEqual(list(UserData.objects.values_list('user_id', 'data')), [(1, '{"search": "chair"}')])
+
+
+class BroadcasterTest(TestCase):
+    def setUp(self):
+        seed_catalog(sections=1, categories=1, items=1, users=4)
+        catalog.invalidate()
+        self.broadcaster = Broadcaster(rate=1000)
+        self.broadcaster.bot = FakeBot()
+        self.broadcast = Broadcast.objects.create(message=Message.objects.get(name='help'),
+                                                  status=Broadcast.RUNNING)
+        self.users = list(TelegramUser.objects.order_by('pk'))
+        for user in self.users:
+            BroadcastRecipient.objects.create(broadcast=self.broadcast, user=user)
+
+    def sent_to(self):
+        return [data['chat_id'] for method, data in self.broadcaster.bot.calls if method == 'sendMessage']
+
+    def test_recipients_claimed_elsewhere_are_skipped(self):
+        claimed, stale = self.users[:2]
+        BroadcastRecipient.objects.filter(user=claimed).update(status=BroadcastRecipient.SENDING)
+        BroadcastRecipient.objects.filter(user=stale).update(status=BroadcastRecipient.SENDING,
+                                                             updated=timezone.now() - dt.timedelta(days=1))
+        self.broadcaster.run_once()
+        self.assertEqual(self.sent_to(), [user.chat_id for user in self.users if user != claimed])
+
+    def test_recipient_claimed_after_reading_is_skipped(self):
+        other = self.users[-1]
+        send = self.broadcaster.send
+
+        def send_while_other_worker_claims(broadcast, recipient):
+            BroadcastRecipient.objects.filter(user=other).update(status=BroadcastRecipient.SENDING)
+            return send(broadcast, recipient)
+
+        with mock.patch.object(self.broadcaster, 'send', side_effect=send_while_other_worker_claims):
+            self.broadcaster.run_batch(self.broadcast)
+        self.assertEqual(self.sent_to(), [user.chat_id for user in self.users if user != other])
+
+    def test_one_worker_sends(self):
+        Lease.objects.create(name=Broadcaster.lease_name, holder="other:1",
+                             expires=timezone.now() + dt.timedelta(minutes=1))
+        self.assertFalse(self.broadcaster.run_once())
+        self.assertEqual(self.sent_to(), [])
+
+        Lease.objects.update(expires=timezone.now() - dt.timedelta(seconds=1))
+        self.assertTrue(self.broadcaster.run_once())
+        self.assertEqual(self.sent_to(), [user.chat_id for user in self.users])
+        self.assertEqual(Lease.objects.get().holder, self.broadcaster.holder)
+
+
+class LargeCatalogHandlerQueryBudgetTest(HandlerQueryBudgetTest):
+    catalog_size = {'sections': 3, 'categories': 6, 'items': 30, 'users': 200}
+
 
-# Create your tests here.
+class LargeCatalogAdminQueryBudgetTest(AdminQueryBudgetTest):
+    catalog_size = {'sections': 3, 'categories': 6, 'items': 30, 'users': 200}
@@ -0,0 +1,73 @@
+from itertools import count
+
+from main.cache import Snapshot
+from main.models import MessageLanguage, MessageValue
+
+
+_versions = count(1)
+
+
+def _language_values(languages):
+    return [(language.pk, language.name, language.default) for language in languages]
+
+
+class Catalog:
+    """
+    Message texts per language. ``version`` identifies the content, a catalog built with the same
+    content as the ``previous`` one keeps its version.
+    """
+
+    def __init__(self, languages, texts, previous=None):
+        if previous is not None and previous.texts == texts and \
+                _language_values(previous.languages) == _language_values(languages):
+            self.version = previous.version
+        else:
+            self.version = next(_versions)
+        self.languages = languages
+        self.texts = texts
+        self.default_language = next((language for language in languages if language.default), None)
+        self._languages_by_id = {language.pk: language for language in languages}
+        self._languages_by_name = {language.name: language for language in languages}
+
+        # Reverse index for keyboard buttons: text -> {message name: language}
+        self._messages_by_text = {}
+        for language in languages:
+            for name, text in texts.get(language.pk, {}).items():
+                self._messages_by_text.setdefault(text, {}).setdefault(name, language)
+
+    def get_language(self, pk):
+        return self._languages_by_id.get(pk)
+
+    def find_language(self, name):
+        return self._languages_by_name.get(name)
+
+    def find_messages(self, text):
+        return self._messages_by_text.get(text, {})
+
+    def get_translations(self, name):
+        return [texts[name] for texts in self.texts.values() if name in texts]
+
+    def get(self, name, language):
+        if language is None:
+            language = self.default_language
+        if language is None:
+            raise MessageLanguage.DoesNotExist("Default language is not set")
+        try:
+            return self.texts[language.pk][name]
+        except KeyError:
+            pass
+        try:
+            return self.texts[self.default_language.pk][name]
+        except (KeyError, AttributeError):
+            raise MessageValue.DoesNotExist(f"Message '{name}' has no translation for '{language}'")
+
+
+def load_catalog():
+    languages = list(MessageLanguage.objects.all())
+    texts = {language.pk: {} for language in languages}
+    for language_id, name, text in MessageValue.objects.values_list('language_id', 'message__name', 'text'):
+        texts[language_id][name] = text
+    return Catalog(languages, texts, catalog.peek())
+
+
+catalog = Snapshot(load_catalog)
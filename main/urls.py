@@ -1,8 +1,9 @@
 from django.urls import path
 
-from main.views import send_list, get_admins
+from main.views import send_list, get_admins, get_metrics
 
 urlpatterns = [
     path('sendlist', send_list),
-    path('admins', get_admins)
+    path('admins', get_admins),
+    path('metrics', get_metrics)
 ]
\ No newline at end of file
@@ -1,13 +1,106 @@
-from django.http import HttpResponse
-from django.shortcuts import render
+import hashlib
+import hmac
 import json
 
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.views.decorators.http import condition
+
+from main.metrics import metrics
 from main.models import TelegramUser
 
+CHUNK_SIZE = 2000
+
+
+def parse_cursor(request):
+    after, limit = request.GET.get('after'), request.GET.get('limit')
+    after = int(after) if after not in (None, '') else None
+    limit = int(limit) if limit not in (None, '') else None
+    if limit is not None and limit <= 0:
+        raise ValueError("limit must be positive")
+    return after, limit
+
+
+def iterate_chat_ids(queryset, after=None, limit=None):
+    """
+    Yields lists of chat ids ordered by chat_id, paginating by the last seen id instead of OFFSET.
+    """
+    while limit is None or limit > 0:
+        page = queryset.filter(chat_id__gt=after) if after is not None else queryset
+        size = CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit)
+        chat_ids = list(page.order_by('chat_id').values_list('chat_id', flat=True)[:size])
+        if chat_ids:
+            yield chat_ids
+        if len(chat_ids) < size:
+            return
+        after = chat_ids[-1]
+        if limit is not None:
+            limit -= len(chat_ids)
+
+
+def stream_json_list(chunks, serialize):
+    yield '['
+    first = True
+    for chunk in chunks:
+        yield ('' if first else ', ') + ', '.join(json.dumps(serialize(item)) for item in chunk)
+        first = False
+    yield ']'
+
+
+def make_etag(queryset, request):
+    # The aggregate scans the whole table, pages after the first one stay cheap without it
+    if request.GET.get('after') not in (None, ''):
+        return None
+    # Changes whenever users are added, removed or change their chat id
+    state = queryset.aggregate(count=Count('pk'), last=Max('pk'), checksum=Sum('chat_id'))
+    key = f"{state['count']}:{state['last']}:{state['checksum']}:{request.GET.urlencode()}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def chat_id_list(request, queryset, serialize):
+    try:
+        after, limit = parse_cursor(request)
+    except ValueError:
+        return HttpResponseBadRequest("after and limit must be integers, limit must be positive")
 
+    if limit is None:
+        return StreamingHttpResponse(stream_json_list(iterate_chat_ids(queryset, after), serialize))
+
+    chat_ids = [chat_id for chunk in iterate_chat_ids(queryset, after, limit) for chat_id in chunk]
+    response = HttpResponse(json.dumps([serialize(chat_id) for chat_id in chat_ids]))
+    if len(chat_ids) == limit:
+        response['X-Next-After'] = str(chat_ids[-1])
+    return response
+
+
+def users():
+    return TelegramUser.objects.all()
+
+
+def admins():
+    return TelegramUser.objects.filter(is_admin=True)
+
+
+@condition(etag_func=lambda request: make_etag(users(), request))
 def send_list(request):
-    return HttpResponse(json.dumps([{"Telegram ID": user.chat_id} for user in TelegramUser.objects.all()]))
+    return chat_id_list(request, users(), lambda chat_id: {"Telegram ID": chat_id})
 
 
+@condition(etag_func=lambda request: make_etag(admins(), request))
 def get_admins(request):
-    return HttpResponse(json.dumps([user.chat_id for user in TelegramUser.objects.filter(is_admin=True)]))
+    return chat_id_list(request, admins(), lambda chat_id: chat_id)
+
+
+def can_read_metrics(request):
+    # Prometheus authenticates with METRICS_TOKEN, people through the admin login
+    if request.user.is_active and request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    return bool(token) and hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), f"Bearer {token}")
+
+
+def get_metrics(request):
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')